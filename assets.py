@@ -0,0 +1,39 @@
+"""Static images shown on the pages and embedded in the PDF report.
+
+Each image is read and decoded once per process and kept as encoded bytes at
+the size it is displayed, so every session and the report exporter share the
+same bytes instead of decoding the full-size file on each rerun.
+"""
+
+import functools
+import io
+
+from PIL import Image
+
+LOGO = "FLS1.jpg"
+DIAGRAM = "image2_en.png"
+# El logo ocupa una columna estrecha (unos 200 px), el doble cubre pantallas HiDPI
+LOGO_WIDTH = 400
+
+
+@functools.lru_cache(maxsize=None)
+def image(path, width=None):
+    """Encoded bytes of ``path``, shrunk to ``width`` pixels if it is wider."""
+    with Image.open(path) as original:
+        if width is None or original.width <= width:
+            with open(path, "rb") as file:
+                return file.read()
+        image_format = original.format
+        height = round(original.height * width / original.width)
+        thumbnail = original.resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def logo():
+    return image(LOGO, LOGO_WIDTH)
+
+
+def diagram():
+    return image(DIAGRAM)
@@ -0,0 +1,186 @@
+"""Result cache shared by every Streamlit session of the process.
+
+Spline fits and simulation results are stored under a canonical hash of the
+scenario parameters, so a rerun (or another user) asking for the same
+scenario gets the stored result instead of recomputing it. The in-memory tier
+is a size-bounded LRU; an optional SQLite tier in ``APP_CACHE_DIR`` survives
+restarts.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_MAX_ENTRIES = int(os.environ.get("APP_CACHE_ENTRIES", 256))
+CACHE_MAX_BYTES = int(os.environ.get("APP_CACHE_BYTES", 512 * 2**20))
+CACHE_DIR = os.environ.get("APP_CACHE_DIR")
+DISK_MAX_BYTES = int(os.environ.get("APP_CACHE_DISK_BYTES", 4 * 2**30))
+
+_MISSING = object()
+
+
+def _canonical(value):
+    """JSON-friendly form where equal parameters always look the same."""
+    if hasattr(value, "cache_key"):
+        return _canonical(value.cache_key)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canonical(v) for v in np.asarray(value, dtype=object).ravel()]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        # 200 and 200.0 are the same scenario
+        return repr(float(value))
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+def canonical_key(*parts):
+    """Stable hash of the given parameters."""
+    text = json.dumps(_canonical(list(parts)), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    """Make cached arrays read-only, since every session shares them."""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+class ResultCache:
+    """Thread-safe LRU bounded by entry count and total array bytes."""
+
+    def __init__(self, max_entries, max_bytes, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(directory, "results.sqlite"), check_same_thread=False
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            if self._db is None:
+                return default
+            row = self._db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            self._db.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+        value = _freeze(pickle.loads(row[0]))
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        value = _freeze(value)
+        self._remember(key, value)
+        if self._db is not None:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                    (key, blob, len(blob), time.time()),
+                )
+                self._trim_disk()
+                self._db.commit()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def _remember(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+
+    def _trim_disk(self):
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        while total > DISK_MAX_BYTES:
+            key, size = self._db.execute(
+                "SELECT key, size FROM results ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+
+
+results = ResultCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_DIR)
+
+
+def cached(name, key, compute):
+    """Return the cached value for ``(name, key)``, computing it on a miss."""
+    full_key = canonical_key(name, key)
+    value = results.get(full_key, _MISSING)
+    if value is _MISSING:
+        value = results.put(full_key, compute())
+    return value
+
+
+def cached_curve(p80, recovery):
+    """Recovery curve through the laboratory nodes, fitted once."""
+    from curve import RecoveryCurve
+
+    p80 = np.asarray(p80, dtype=float)
+    recovery = np.asarray(recovery, dtype=float)
+    return cached(
+        "curve",
+        {"p80": p80, "recovery": recovery},
+        lambda: RecoveryCurve.from_nodes(p80, recovery),
+    )
@@ -0,0 +1,122 @@
+"""Recovery curve and P80 distribution charts from precomputed arrays.
+
+The charts never see raw samples: they take the laboratory nodes, a few
+hundred points of the fitted curve and either histogram counts or density
+points of the P80. That keeps the inputs small enough to hash, so rendered
+PNG images are cached by :mod:`cache`, and small enough to send to the browser
+as a Vega-Lite (Altair) chart instead of an image.
+
+A distribution is a tuple ``(label, x, y)``: ``("Count", edges, counts)`` for
+a histogram or ``("Density", x, density)`` for a density curve.
+"""
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import cache
+import figures
+import simulation
+
+COLOR_CURVE = "#002A54"
+COLOR_P80 = "#C94F7E"
+HIST_BINS = 20
+
+
+def curve_points(curve, p80, points=100, margin=0.05):
+    """Curve evaluated on a dense grid around the nodes ``p80``."""
+    p80 = np.asarray(p80, dtype=float)
+    tramo = p80.max() - p80.min()
+    x_new = np.linspace(p80.min() - tramo * margin, p80.max() + tramo * margin, points)
+    return x_new, curve(x_new)
+
+
+def histogram(values, bins=HIST_BINS):
+    """Histogram distribution of the valid (non-NaN) simulated P80."""
+    values = np.asarray(values, dtype=float)
+    counts, edges = np.histogram(values[np.isfinite(values)], bins=bins)
+    return "Count", edges, counts
+
+
+def density(mean, std, upper, shape=None, lower=35, points=200):
+    """P80 density distribution, for the exact mode where there are no samples."""
+    x_pdf = np.linspace(lower, upper, points)
+    return "Density", x_pdf, simulation.p80_pdf(x_pdf, mean, std, shape)
+
+
+def draw_distribution(ax, distribution, color=COLOR_P80, **kwargs):
+    """Draw ``distribution`` on ``ax`` and return its axis label."""
+    label, x, y = distribution
+    if label == "Count":
+        ax.bar(x[:-1], y, width=np.diff(x), align="edge", color=color, **kwargs)
+    else:
+        ax.fill_between(x, y, color=color, alpha=0.5)
+    return label
+
+
+def recovery_figure(nodes, points, distribution):
+    """Laboratory nodes, fitted curve and P80 distribution on twin axes."""
+    fig1, ax = figures.new_figure(figsize=(12, 8))
+    ax2 = ax.twinx()
+
+    ax.plot(*nodes, "o", label="Puntos Originales", markersize=15.0)
+    ax.plot(*points, "-", label="Curva Ajustada", linewidth=3.0)
+    ax.set_xlabel("P80 (µm)", fontsize=22)
+    ax.set_ylabel("Recovery (%)", fontsize=22)
+    ax.tick_params(axis="both", labelsize=15)
+
+    ax.set_axisbelow(True)
+    ax.spines["bottom"].set_linewidth(2.0)
+    ax.spines["left"].set_linewidth(2.0)
+
+    label = draw_distribution(ax2, distribution, linewidth=1.5)
+    ax2.set_ylabel(label, fontsize=22)
+    return fig1
+
+
+def recovery_png(nodes, points, distribution):
+    """PNG bytes of :func:`recovery_figure`, rendered once per distinct input."""
+    label, x, y = distribution
+    key = {
+        "nodes": {"x": nodes[0], "y": nodes[1]},
+        "points": {"x": points[0], "y": points[1]},
+        "distribution": {"label": label, "x": x, "y": y},
+    }
+    return cache.cached(
+        "recovery_chart",
+        key,
+        lambda: figures.to_png(recovery_figure(nodes, points, distribution)),
+    )
+
+
+def recovery_altair(nodes, points, distribution):
+    """Vega-Lite version of :func:`recovery_figure`, drawn by the browser."""
+    label, x, y = distribution
+    x_axis = alt.X("P80:Q", title="P80 (µm)")
+    recovery_axis = alt.Y("Recovery:Q", title="Recovery (%)")
+    curve = (
+        alt.Chart(pd.DataFrame({"P80": points[0], "Recovery": points[1]}))
+        .mark_line(color=COLOR_CURVE, strokeWidth=3)
+        .encode(x_axis, recovery_axis)
+    )
+    dots = (
+        alt.Chart(pd.DataFrame({"P80": nodes[0], "Recovery": nodes[1]}))
+        .mark_circle(color=COLOR_CURVE, size=150, opacity=1)
+        .encode(x_axis, recovery_axis, tooltip=["P80", "Recovery"])
+    )
+    value_axis = alt.Y(f"{label}:Q", title=label)
+    if label == "Count":
+        frame = pd.DataFrame({"P80": x[:-1], "P80 end": x[1:], label: y})
+        p80 = (
+            alt.Chart(frame)
+            .mark_bar(color=COLOR_P80, opacity=0.6)
+            .encode(x_axis, x2="P80 end:Q", y=value_axis)
+        )
+    else:
+        p80 = (
+            alt.Chart(pd.DataFrame({"P80": x, label: y}))
+            .mark_area(color=COLOR_P80, opacity=0.5)
+            .encode(x_axis, y=value_axis)
+        )
+    # La curva y los nodos comparten el eje izquierdo, la distribucion el derecho
+    return alt.layer(alt.layer(curve, dots), p80).resolve_scale(y="independent")
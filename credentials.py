@@ -0,0 +1,120 @@
+"""Login credentials kept in ``contrasenas.csv``.
+
+The file is loaded into a dict keyed by the normalized email, so a login is a
+single lookup plus one bcrypt check. The store compares the file's mtime on
+every lookup and reloads it when it changes, so accounts can be added without
+restarting the app. Passwords found in plain text are hashed with bcrypt and
+written back to the file on load; when the file is read-only the hashes are
+only kept in memory. Rows without an email or password are skipped.
+"""
+
+import csv
+import os
+import stat
+import tempfile
+import threading
+
+import bcrypt
+from streamlit.logger import get_logger
+
+CREDENTIALS_FILE = os.environ.get("APP_CREDENTIALS", "contrasenas.csv")
+EMAIL_COLUMN = "correo"
+PASSWORD_COLUMN = "contrasena"
+# Hash de relleno para que un correo desconocido tarde lo mismo que uno valido
+DUMMY_HASH = b"$2b$12$SPly6P6o.zVNEbPXcPjOr..UvYy2qmz.JWxeeXhKvGFcRKN3YD8G2"
+
+logger = get_logger(__name__)
+
+
+def normalize(correo):
+    return correo.strip().lower()
+
+
+def _is_hash(value):
+    return len(value) == 60 and value.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password(contrasena):
+    return bcrypt.hashpw(contrasena.encode(), bcrypt.gensalt()).decode()
+
+
+class CredentialStore:
+    """Thread-safe view of a credentials CSV, reloaded when its mtime changes."""
+
+    def __init__(self, path=CREDENTIALS_FILE):
+        self.path = path
+        self._users = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        with open(self.path, newline="", encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            return reader.fieldnames, list(reader)
+
+    def _write(self, fieldnames, rows):
+        # Reemplazo atomico: otro proceso nunca ve el archivo a medio escribir
+        directory = os.path.dirname(os.path.abspath(self.path))
+        mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        fd, temp = tempfile.mkstemp(dir=directory, suffix=".csv")
+        try:
+            with os.fdopen(fd, "w", newline="", encoding="utf-8") as file:
+                writer = csv.DictWriter(
+                    file,
+                    fieldnames,
+                    restval="",
+                    extrasaction="ignore",
+                    lineterminator="\n",
+                )
+                writer.writeheader()
+                writer.writerows(rows)
+            # mkstemp crea el archivo con modo 0600; se conserva el original
+            os.chmod(temp, mode)
+            os.replace(temp, self.path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+    def _load(self):
+        fieldnames, rows = self._read()
+        valid = []
+        for line, row in enumerate(rows, start=2):
+            if not row.get(EMAIL_COLUMN) or not row.get(PASSWORD_COLUMN):
+                logger.warning(
+                    "%s:%d has no email or password, skipped", self.path, line
+                )
+                continue
+            valid.append(row)
+        plain = [row for row in valid if not _is_hash(row[PASSWORD_COLUMN])]
+        for row in plain:
+            row[PASSWORD_COLUMN] = hash_password(row[PASSWORD_COLUMN])
+        if plain:
+            try:
+                self._write(fieldnames, rows)
+            except OSError as error:
+                # Archivo de solo lectura: los hashes quedan solo en memoria
+                logger.warning("Could not store password hashes: %s", error)
+        return {normalize(row[EMAIL_COLUMN]): row for row in valid}
+
+    def users(self):
+        """Accounts by normalized email, reloading the file if it changed."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    self._users = self._load()
+                    # Reescribir los hashes cambia el mtime
+                    self._mtime = os.stat(self.path).st_mtime_ns
+        return self._users
+
+    def authenticate(self, correo, contrasena):
+        """The account row if the password matches, otherwise ``None``."""
+        user = self.users().get(normalize(correo))
+        hashed = user[PASSWORD_COLUMN].encode() if user else DUMMY_HASH
+        if bcrypt.checkpw(str(contrasena).encode(), hashed) and user:
+            return user
+        return None
+
+
+store = CredentialStore()
@@ -0,0 +1,139 @@
+"""Recovery versus P80 curve fitted to the laboratory nodes.
+
+Between the first and the last node the curve is the natural cubic spline
+through the nodes; outside them it follows the tangent line at the end node,
+the same linear tails drawn on the model page. Natural end conditions make the
+second derivative zero at the end nodes, so the tails join the spline
+smoothly. The tails are stored as two extra linear pieces, so the whole curve
+is one piecewise polynomial that the simulation, the exact integrator and the
+charts all evaluate the same way.
+"""
+
+import numpy as np
+from scipy.interpolate import CubicSpline, PPoly
+
+
+def with_tails(spline):
+    """Breakpoints and coefficients of ``spline`` plus its two linear tails.
+
+    Works with batched splines (2D ``y``); the tail coefficients keep the
+    trailing dimensions of ``spline.c``.
+    """
+    x = spline.x
+    first, last = spline(x[0]), spline(x[-1])
+    slope_first, slope_last = spline(x[0], 1), spline(x[-1], 1)
+    zero = np.zeros_like(first)
+    # La cola inferior empieza 1 um antes del primer nodo, como en el grafico
+    lower = np.stack((zero, zero, slope_first, first - slope_first))[:, None]
+    upper = np.stack((zero, zero, slope_last, last))[:, None]
+    breaks = np.concatenate(([x[0] - 1], x, [x[-1] + 1]))
+    return breaks, np.concatenate((lower, spline.c, upper), axis=1)
+
+
+class RecoveryCurve:
+    """Immutable, picklable recovery curve with linear tails.
+
+    ``x`` holds the breakpoints (the nodes plus one point past each end) and
+    ``c`` the coefficients of every piece in the local variable
+    ``x - x[i]``, highest power first, as in ``scipy.interpolate.PPoly``.
+    """
+
+    __slots__ = ("x", "c")
+
+    def __init__(self, x, c):
+        x = np.array(x, dtype=float)
+        c = np.array(c, dtype=float)
+        if c.ndim != 2 or c.shape[1] != x.size - 1:
+            raise ValueError("Coefficients must have one column per piece")
+        x.setflags(write=False)
+        c.setflags(write=False)
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "c", c)
+
+    @classmethod
+    def from_nodes(cls, p80, recovery):
+        """Natural cubic spline through the nodes, with its tangent tails."""
+        spline = CubicSpline(
+            np.asarray(p80, dtype=float),
+            np.asarray(recovery, dtype=float),
+            bc_type="natural",
+        )
+        return cls(*with_tails(spline))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RecoveryCurve is immutable")
+
+    def __reduce__(self):
+        return (RecoveryCurve, (self.x, self.c))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RecoveryCurve)
+            and np.array_equal(self.x, other.x)
+            and np.array_equal(self.c, other.c)
+        )
+
+    def __hash__(self):
+        return hash((self.x.tobytes(), self.c.tobytes()))
+
+    def __repr__(self):
+        return f"RecoveryCurve(nodes={self.nodes.tolist()})"
+
+    @property
+    def cache_key(self):
+        return {"x": self.x, "c": self.c}
+
+    def __call__(self, x, nu=0):
+        """Curve (or its ``nu``-th derivative) at ``x``, for any array shape."""
+        x = np.asarray(x, dtype=float)
+        # Buscar solo entre los nodos deja las colas en la primera y ultima pieza
+        index = np.searchsorted(self.x[1:-1], x, side="right")
+        dx = x - self.x.take(index)
+        c = self.c
+        for _ in range(nu):
+            c = c[:-1] * np.arange(c.shape[0] - 1, 0, -1)[:, None]
+        if c.shape[0] == 0:
+            return np.zeros_like(dx)
+        result = c[0].take(index)
+        for row in c[1:]:
+            result *= dx
+            result += row.take(index)
+        return result
+
+    def ppoly(self):
+        return PPoly(self.c, self.x)
+
+    def roots(self, extrapolate=True):
+        return self.ppoly().roots(extrapolate=extrapolate)
+
+    def derivative(self, nu=1):
+        return self.ppoly().derivative(nu)
+
+    def antiderivative(self, nu=1):
+        return self.ppoly().antiderivative(nu)
+
+    @property
+    def nodes(self):
+        return self.x[1:-1]
+
+    @property
+    def node_min(self):
+        return self.x[1]
+
+    @property
+    def node_max(self):
+        return self.x[-2]
+
+    @property
+    def upper(self):
+        """P80 where the upper tail reaches zero recovery."""
+        slope, value = self.c[2, -1], self.c[3, -1]
+        if slope >= 0:
+            raise ValueError("The recovery curve must decrease after the last node")
+        return self.node_max - value / slope
+
+    def tails(self, points=100):
+        """Points of the two tails as drawn on the model page."""
+        x_new_1 = np.linspace(0, self.node_min - 1, points)
+        x_new_2 = np.linspace(self.node_max + 1, self.upper, points)
+        return x_new_1, self(x_new_1), x_new_2, self(x_new_2)
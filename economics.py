@@ -0,0 +1,88 @@
+"""Economic value of a recovery improvement.
+
+Every function broadcasts over NumPy arrays, so a single recovery difference
+can be evaluated over whole grids of copper price, head grade and throughput.
+"""
+
+import numpy as np
+import pandas as pd
+
+LB_PER_TONNE = 2204.63
+DAYS_PER_YEAR = 365
+
+
+def additional_income(rec_dif, ton_diario, ley, precio):
+    """Additional fine copper and income for a recovery difference in points.
+
+    Returns ``(cobre_ad, ppd, us_day, us_year)``: tonnes per day of fine
+    copper, pounds per day, US$/day and US$/year.
+    """
+    cobre_ad = ton_diario * ley / 100 * rec_dif / 100
+    ppd = cobre_ad * LB_PER_TONNE
+    us_day = ppd * precio
+    us_year = us_day * DAYS_PER_YEAR
+    return cobre_ad, ppd, us_day, us_year
+
+
+def income_grid(rec_dif, rec_dif_ci, prices, grades, tphs):
+    """US$/day and US$/year over every price x grade x TPH combination.
+
+    The recovery difference and its confidence interval are computed once
+    and broadcast over the grid. Returns a long table with one row per
+    combination.
+    """
+    price, grade, tph = np.meshgrid(prices, grades, tphs, indexing="ij")
+    table = {
+        "Copper Price (US$/lb)": price.ravel(),
+        "Copper Grade (%)": grade.ravel(),
+        "Daily TPH": tph.ravel(),
+    }
+    for suffix, value in (
+        ("", rec_dif),
+        (" low", rec_dif_ci[0]),
+        (" high", rec_dif_ci[1]),
+    ):
+        _, _, us_day, us_year = additional_income(value, tph, grade, price)
+        table["US$/day" + suffix] = us_day.ravel()
+        table["US$/year" + suffix] = us_year.ravel()
+    return pd.DataFrame(table)
+
+
+def strategy_table(names, means, stds, comparison, ton_diario, ley, precio):
+    """Strategies ranked by recovery, with their gain over the baseline.
+
+    ``comparison`` is the result of :func:`simulation.compare_strategies`,
+    or any mapping with the same per-strategy arrays.
+    """
+    difference = np.asarray(comparison["difference"], dtype=float)
+    table = pd.DataFrame(
+        {
+            "Strategy": list(names),
+            "Average P80": means,
+            "Standard Deviation P80": stds,
+            "Recovery (%)": comparison["simul_recovery"],
+            "Standard Error": comparison["std_error"],
+            "Delta vs Baseline (%)": difference,
+            "Delta Low": comparison["difference_low"],
+            "Delta High": comparison["difference_high"],
+            "US$/year": additional_income(difference, ton_diario, ley, precio)[3],
+        }
+    )
+    table = table.sort_values("Recovery (%)", ascending=False, kind="stable")
+    table.insert(0, "Rank", np.arange(1, len(table) + 1))
+    return table.reset_index(drop=True)
+
+
+def bond_throughput(p80, reference_p80, reference_tph, f80):
+    """Throughput at constant mill power, scaled by Bond's law.
+
+    The specific energy is proportional to ``1/sqrt(P80) - 1/sqrt(F80)``, so
+    a coarser grind lets the same mill treat more ore. Returns the throughput
+    and its derivative with respect to the P80.
+    """
+    p80 = np.asarray(p80, dtype=float)
+    energy = 1 / np.sqrt(p80) - 1 / np.sqrt(f80)
+    reference = 1 / np.sqrt(reference_p80) - 1 / np.sqrt(f80)
+    tph = reference_tph * reference / energy
+    d_tph = tph / energy * 0.5 * p80**-1.5
+    return tph, d_tph
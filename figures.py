@@ -0,0 +1,65 @@
+"""Matplotlib figures built without pyplot.
+
+``matplotlib.pyplot`` keeps a global registry of open figures and global
+rcParams, both shared by every Streamlit session thread. Figures made here are
+plain ``matplotlib.figure.Figure`` objects: they are never registered, carry
+their own styling and are cleared as soon as they have been rendered, so
+reruns do not accumulate figures in memory.
+"""
+
+import io
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+
+FONT_SIZE = 16
+GRID_STYLE = {"linewidth": 0.2, "color": "gray", "linestyle": "-"}
+
+
+def new_figure(figsize=(12, 8), nrows=1, ncols=1, grid=False, **kwargs):
+    """Figure and axes with the app style, without touching pyplot state.
+
+    ``grid`` draws the light horizontal grid used on the recovery charts.
+    """
+    fig = Figure(figsize=figsize)
+    axes = fig.subplots(nrows, ncols, squeeze=False, **kwargs)
+    for ax in axes.flat:
+        ax.tick_params(axis="both", labelsize=FONT_SIZE * 0.8)
+        ax.xaxis.label.set_size(FONT_SIZE)
+        ax.yaxis.label.set_size(FONT_SIZE)
+        ax.title.set_size(FONT_SIZE)
+        if grid:
+            ax.grid(True, axis="y", **GRID_STYLE)
+    if nrows == ncols == 1:
+        return fig, axes[0, 0]
+    return fig, axes.squeeze()
+
+
+def colors(n, name="tab10"):
+    """``n`` colors from a qualitative colormap, cycling when it runs out."""
+    cmap = colormaps[name]
+    return cmap(np.arange(n) % cmap.N)
+
+
+def close(fig):
+    # Sin pyplot no hay registro que cerrar: basta con soltar los artistas
+    fig.clear()
+
+
+def to_png(fig, **kwargs):
+    """Render ``fig`` to PNG bytes and release it."""
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format="png", **kwargs)
+    finally:
+        close(fig)
+    return buffer.getvalue()
+
+
+def show(container, fig):
+    """Draw ``fig`` with ``container.pyplot`` (``st`` or a placeholder) and release it."""
+    try:
+        container.pyplot(fig)
+    finally:
+        close(fig)
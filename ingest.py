@@ -0,0 +1,167 @@
+"""Chunked statistics of historical P80 logs.
+
+Historian exports can hold tens of millions of rows, so they are never loaded
+into a DataFrame: CSV files are parsed block by block with
+``pyarrow.csv.open_csv`` and Parquet files are read by record batch. Every
+batch is folded into running moments and a fine fixed-width histogram, from
+which the quantiles are read at the end.
+
+Files on the server can only be read from inside ``APP_HISTORY_DIR``. Errors
+raised as :class:`HistoryError` carry messages that are safe to show to the
+user; parser errors from pyarrow may quote the file and are not.
+"""
+
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+import simulation
+
+HIST_MAX = 2000.0
+HIST_STEP = 0.1
+BLOCK_SIZE = 16 * 2**20
+QUANTILES = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95)
+HEADER_BLOCK_SIZE = 2**20
+NUMBER = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+HISTORY_DIR = os.environ.get("APP_HISTORY_DIR")
+
+
+class HistoryError(ValueError):
+    """Invalid P80 history, with a message that can be shown to the user."""
+
+
+def history_path(name, directory=HISTORY_DIR):
+    """Real path of ``name`` inside the history directory.
+
+    Symlinks and ``..`` are resolved first, so nothing outside the directory
+    can be reached.
+    """
+    if not directory:
+        raise HistoryError("Server files are disabled, set APP_HISTORY_DIR")
+    root = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise HistoryError("Server files must be inside the history directory")
+    if not os.path.isfile(path):
+        raise HistoryError(f"File {name!r} not found in the history directory")
+    return path
+
+
+def _open(source):
+    """Memory-map paths; file-like objects (uploads) are read as they are."""
+    if isinstance(source, str):
+        return pa.memory_map(history_path(source))
+    source.seek(0)
+    return source
+
+
+def _is_parquet(stream):
+    magic = stream.read(4)
+    stream.seek(0)
+    return magic == b"PAR1"
+
+
+def _p80_column(names, column):
+    if column is not None:
+        if column not in names:
+            raise HistoryError(f"Column {column!r} not found in the P80 history")
+        return column
+    for name in names:
+        if "p80" in name.lower():
+            return name
+    raise HistoryError("No P80 column found, name one explicitly")
+
+
+def p80_batches(source, column=None, delimiter=";", decimal_point="."):
+    """Yield the P80 column of a CSV or Parquet file as NumPy arrays.
+
+    ``source`` is a path inside the history directory or a binary file object. ``column`` defaults to the
+    first column whose name contains "p80". Values that cannot be parsed, such
+    as historian status text, are returned as NaN.
+    """
+    stream = _open(source)
+    if _is_parquet(stream):
+        parquet = pq.ParquetFile(stream)
+        column = _p80_column(parquet.schema_arrow.names, column)
+        for batch in parquet.iter_batches(columns=[column]):
+            yield _to_numpy(batch.column(0), decimal_point)
+        return
+
+    parse_options = pv.ParseOptions(delimiter=delimiter)
+    # Primero solo la cabecera, para saber que columna leer como texto
+    header = pv.open_csv(
+        stream,
+        read_options=pv.ReadOptions(block_size=HEADER_BLOCK_SIZE),
+        parse_options=parse_options,
+    )
+    column = _p80_column(header.schema.names, column)
+    stream.seek(0)
+    # Como texto, una fila con "Bad Input" no detiene la lectura del archivo
+    reader = pv.open_csv(
+        stream,
+        read_options=pv.ReadOptions(block_size=BLOCK_SIZE),
+        parse_options=parse_options,
+        convert_options=pv.ConvertOptions(
+            column_types={column: pa.string()}, include_columns=[column]
+        ),
+    )
+    for batch in reader:
+        yield _to_numpy(batch.column(0), decimal_point)
+
+
+def _to_numpy(values, decimal_point="."):
+    """Float values, with anything that is not a number as NaN."""
+    if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+        values = pc.utf8_trim_whitespace(values)
+        if decimal_point != ".":
+            values = pc.replace_substring(values, decimal_point, ".")
+        valid = pc.match_substring_regex(values, NUMBER)
+        values = pc.if_else(valid, values, pa.scalar(None, values.type))
+    values = values.cast(pa.float64())
+    return values.to_numpy(zero_copy_only=False).astype(float)
+
+
+def p80_statistics(batches, hist_max=HIST_MAX, step=HIST_STEP, quantiles=QUANTILES):
+    """Mean, std, quantiles and histogram of the P80 in a single pass.
+
+    Missing and non-positive values (historian dropouts) are skipped and
+    counted in ``dropped``. Quantiles are interpolated inside histogram bins of
+    width ``step``; values above ``hist_max`` go to the last bin.
+    """
+    edges = np.arange(0, hist_max + step, step)
+    counts = np.zeros(edges.size - 1, dtype=np.int64)
+    moments = (0, 0.0, 0.0)
+    p80_min, p80_max, dropped = np.inf, -np.inf, 0
+    for values in batches:
+        valid = np.isfinite(values) & (values > 0)
+        dropped += values.size - np.count_nonzero(valid)
+        values = values[valid]
+        if values.size == 0:
+            continue
+        moments = simulation.update_moments(moments, values)
+        p80_min = min(p80_min, values.min())
+        p80_max = max(p80_max, values.max())
+        index = np.minimum((values / step).astype(np.int64), counts.size - 1)
+        counts += np.bincount(index, minlength=counts.size)
+
+    count, mean, m2 = moments
+    if count == 0:
+        raise HistoryError("The P80 history has no valid values")
+    cumulative = np.concatenate(([0], np.cumsum(counts))) / count
+    return {
+        "count": count,
+        "dropped": dropped,
+        "mean": mean,
+        "std": np.sqrt(m2 / (count - 1)) if count > 1 else 0.0,
+        "min": p80_min,
+        "max": p80_max,
+        "quantiles": {
+            q: float(np.clip(np.interp(q, cumulative, edges), p80_min, p80_max))
+            for q in quantiles
+        },
+        "hist": (counts, edges),
+    }
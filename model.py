@@ -2,30 +2,97 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
-from scipy.interpolate import CubicSpline
-from scipy.stats import norm
-import random
+import os
 import math
-import time
-import altair as alt
 import re
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from streamlit_metrics import metric, metric_row
-from st_aggrid import AgGrid, DataReturnMode, GridUpdateMode, GridOptionsBuilder
+from streamlit.logger import get_logger
+from streamlit_metrics import metric
 
-from PIL import Image
+import startup
+import credentials
+import economics
+import pipeline
 
-from fpdf import FPDF
+# Los modulos pesados (scipy, matplotlib, altair, fpdf, pyarrow, PIL) se
+# importan la primera vez que una pagina los usa, no en la pantalla de login
+assets = startup.lazy("assets")
+cache = startup.lazy("cache")
+charts = startup.lazy("charts")
+figures = startup.lazy("figures")
+ingest = startup.lazy("ingest")
+optimizer = startup.lazy("optimizer")
+parallel = startup.lazy("parallel")
+report = startup.lazy("report")
+simulation = startup.lazy("simulation")
 
-contras = pd.read_csv("contrasenas.csv")
+logger = get_logger(__name__)
+
+CALC_MODES = ("Monte Carlo", "Exact")
+STREAM_REFRESH = 10
+P80_DISTRIBUTIONS = ("Normal", "Empirical", "KDE")
+CHART_RENDERERS = ("Image", "Interactive")
+CSV_DELIMITERS = {"Semicolon": ";", "Comma": ",", "Tab": "\t"}
+DECIMAL_POINTS = {"Point": ".", "Comma": ","}
 
 
 def es_correo_valido(correo):
     return re.match(r"^[^@]+@[^@]+\.[^@]+$", correo)
 
 
+def simulation_frame(sim):
+    return pd.DataFrame(
+        {
+            col: sim[col]
+            for col in ("random", "Simulated_p80", "Simulated_p80_check", "recovery")
+        }
+    )
+
+
+def cached_simulation(name, curve, compute, **params):
+    # Resultado compartido entre sesiones, con clave en la curva que usa el
+    # calculo (RecoveryCurve.cache_key) y el escenario
+    return cache.cached(name, {"curve": curve, **params}, compute)
+
+
+def show_recovery_chart(container, nodes, points, distribution, cached=True):
+    # Imagen cacheada en el servidor, o grafico Vega-Lite dibujado en el navegador
+    if st.session_state.get("chart_renderer") == CHART_RENDERERS[1]:
+        container.altair_chart(
+            charts.recovery_altair(nodes, points, distribution),
+            use_container_width=True,
+        )
+    elif cached:
+        container.image(charts.recovery_png(nodes, points, distribution))
+    else:
+        container.image(
+            figures.to_png(charts.recovery_figure(nodes, points, distribution))
+        )
+
+
+def require_curve():
+    # Sin una curva valida de la pagina del modelo no hay nada que calcular
+    curve = st.session_state.get("curve")
+    if curve is None:
+        st.error("Define a valid recovery curve on the Flotation Model page first")
+        st.stop()
+    return curve
+
+
+def show_report(key, label, file_name):
+    # El informe se genera en segundo plano; mientras tanto la pagina responde
+    future = st.session_state.get(key)
+    if future is None:
+        return
+    if not future.done():
+        st.info("Generating report...")
+        st.button("Refresh", key=f"{key}_refresh")
+    elif future.exception() is not None:
+        st.error(f"Report failed: {future.exception()}")
+    else:
+        st.download_button(label, data=future.result(), file_name=file_name)
+
+
 def main():
     st.set_page_config(layout="wide")
 
@@ -50,16 +117,11 @@ def main():
                 # form.reset()
             elif not es_correo_valido(correo):
                 st.error("El correo electrónico no es válido.", icon="❌")
-            elif not (
-                len(contras.loc[contras["correo"] == correo, :]) == 1
-                and contras.loc[contras["correo"] == correo, :]["contrasena"].values[0]
-                == str(contrasena)
-            ):
+            elif credentials.store.authenticate(correo, contrasena) is None:
                 st.error("Correo y/o contraseña inválidos.", icon="❌")
             else:
                 st.success("Ingresando", icon="✅")
                 st.session_state["condicion"] = True
-                time.sleep(2)
                 st.rerun()
 
     if "page" not in st.session_state:
@@ -85,17 +147,20 @@ def main():
             "Flotation Model": page_model,
             "Sensitivity analysis": page_sensitivity,
             "Economic Evaluation": page_eco,
+            "Time Series": page_series,
         }
         with st.sidebar:
             page = st.radio("Go to", tuple(pages.keys()))
         pages[page]()
+        startup.log_once(page)
+    else:
+        startup.log_once("Login")
 
 
 def page_home():
     col1111, col1112, col1113 = st.columns((1, 8, 1.5))
     with col1113:
-        image = Image.open("FLS1.jpg")
-        st.image(image, caption="OCS")
+        st.image(assets.logo(), caption="OCS")
         st.write("")
     with col1112:
         st.title("Evaluation of Milling-Flotation Productivity Improvement Strategies")
@@ -113,8 +178,7 @@ def page_home():
         st.write("")
         st.write("")
         st.write("")
-        image = Image.open("image2_en.png")
-        st.image(image)
+        st.image(assets.diagram())
         st.write("")
 
 
@@ -125,14 +189,64 @@ def page_model():
         st.title("Evaluation of Milling-Flotation Productivity Improvement Strategies")
         st.write("")
     with col13:
-        image = Image.open("FLS1.jpg")
-        st.image(image, caption="OCS")
+        st.image(assets.logo(), caption="OCS")
         st.write("")
 
     col111, col112, col113, col114, col115 = st.columns((1, 2, 2, 2, 1))
     with col113:
         global file_template
         file_template = st.file_uploader("Sube Archivo")
+        with st.expander("P80 History"):
+            # Historial completo del historiador, leido por bloques
+            history_file = st.file_uploader(
+                "Historian Export (CSV or Parquet)", type=["csv", "txt", "parquet"]
+            )
+            history_path = st.text_input(
+                "Or Server File Path",
+                help="Relative to the server history directory (APP_HISTORY_DIR); "
+                "large files are memory-mapped",
+            )
+            history_column = st.text_input(
+                "P80 Column", help="Defaults to the first column containing 'p80'"
+            )
+            history_delimiter = st.selectbox("CSV Delimiter", tuple(CSV_DELIMITERS))
+            history_decimal = st.selectbox("Decimal Separator", tuple(DECIMAL_POINTS))
+        history = None
+        if history_file is not None or history_path:
+            try:
+                if history_file is not None:
+                    source = history_file
+                    key = [history_file.name, history_file.size, history_file.file_id]
+                else:
+                    source = ingest.history_path(history_path)
+                    stat = os.stat(source)
+                    key = [source, stat.st_size, stat.st_mtime]
+                history = cache.cached(
+                    "p80_history",
+                    {
+                        "source": key,
+                        "column": history_column,
+                        "delimiter": history_delimiter,
+                        "decimal": history_decimal,
+                    },
+                    lambda: ingest.p80_statistics(
+                        ingest.p80_batches(
+                            source,
+                            column=history_column or None,
+                            delimiter=CSV_DELIMITERS[history_delimiter],
+                            decimal_point=DECIMAL_POINTS[history_decimal],
+                        )
+                    ),
+                )
+            except ingest.HistoryError as error:
+                st.error(f"Could not read the P80 history: {error}")
+            except (OSError, ValueError):
+                # El error del parser puede citar el archivo: solo va al log
+                logger.exception("Could not read the P80 history")
+                st.error(
+                    "Could not read the P80 history, check the file format, "
+                    "delimiter and decimal separator"
+                )
         st.write("")
         st.write("")
         st.write("")
@@ -156,6 +270,19 @@ def page_model():
             simul_number_val = 1000
             node_number_val = 3
 
+        if history is not None:
+            # La media y desviacion del historial reemplazan a las del archivo
+            average_p80_val = int(np.clip(round(history["mean"]), 35, 300))
+            std_p80_val = max(1, int(round(history["std"])))
+            quantiles = history["quantiles"]
+            st.info(
+                f"P80 history: {history['count']:,} values "
+                f"({history['dropped']:,} skipped), "
+                f"mean {round(history['mean'],1)}, std {round(history['std'],1)}, "
+                f"P10 / P50 / P90 {round(quantiles[0.1],1)} / "
+                f"{round(quantiles[0.5],1)} / {round(quantiles[0.9],1)}"
+            )
+
         templates = ["1-Chuquicamata", "2-El Salvador", "3-Disputada", "4-Customizable"]
         st.subheader("Plant historical P80 data")
         st.write("")
@@ -174,6 +301,56 @@ def page_model():
             "Number of Nodes", min_value=3, max_value=8, value=node_number_val
         )
         template_sim = st.selectbox("Select a Template", templates, index=3)
+        st.session_state.calc_mode = st.selectbox(
+            "Calculation Mode", CALC_MODES, help="Exact mode integrates the curve"
+        )
+        st.session_state.sampler = st.selectbox("Sampler", simulation.SAMPLERS)
+        st.session_state.truncate = st.checkbox(
+            "Truncated Sampling",
+            help="Draw P80 only inside the valid window, so no sample is discarded",
+        )
+        distribution = st.selectbox(
+            "P80 Distribution",
+            P80_DISTRIBUTIONS if history is not None else P80_DISTRIBUTIONS[:1],
+            help="Empirical and KDE shapes are built from the P80 history and "
+            "rescaled to the average and deviation above",
+        )
+        st.session_state.p80_shape = None
+        if distribution != P80_DISTRIBUTIONS[0]:
+            st.session_state.p80_shape = simulation.p80_shape(
+                *history["hist"], kde=distribution == P80_DISTRIBUTIONS[2]
+            )
+        shape = st.session_state.p80_shape
+        st.session_state.seed = st.number_input("Random Seed", min_value=0, value=0)
+        st.session_state.workers = st.number_input(
+            "Worker Processes",
+            min_value=1,
+            max_value=parallel.WORKERS,
+            value=parallel.WORKERS,
+            help="Large simulations and grids are split across worker processes; "
+            "the pool is shared, this caps how many of them one job uses",
+        )
+        st.session_state.chart_renderer = st.selectbox(
+            "Chart Rendering",
+            CHART_RENDERERS,
+            help="Interactive charts are drawn by the browser from the curve "
+            "points and histogram counts",
+        )
+        stream_mode = st.checkbox(
+            "Streaming Mode",
+            help="Simulate in blocks with constant memory and update the chart",
+        )
+        if stream_mode:
+            chunk_size = st.number_input(
+                "Block Size", min_value=1000, value=100000, step=10000
+            )
+            tolerance = st.number_input(
+                "Standard Error Tolerance",
+                min_value=0.0,
+                value=0.0,
+                step=0.001,
+                format="%.4f",
+            )
     st.write("")
     st.write("")
 
@@ -310,9 +487,6 @@ def page_model():
         else:
             df_test = df_template.copy()
 
-        st.session_state.x = df_test["p80"]
-        st.session_state.y = df_test["Recovery"]
-
         ## ESTE ES EL PEDAZO INSERTADO ********************************
 
         # p8 = df_test["p80"].tolist()
@@ -326,153 +500,223 @@ def page_model():
         max_graph = round(p80_max * 1.1)
         min_graph = round(p80_min * 0.8)
 
-        # ACÁ ESTÁ DEFINIDO f *************************************************
-
-        f = CubicSpline(st.session_state.x, st.session_state.y, bc_type="natural")
-        st.session_state.f = f
-
-        # ACÁ ESTÁ DEFINIDO f *************************************************
-
-        st.session_state.x1_min = df_test["p80"].iloc[0]
-        slope_1 = f(st.session_state.x1_min, 1)
-        c_1 = df_test["Recovery"].iloc[0] - slope_1 * st.session_state.x1_min
-        x0_1 = -c_1 / slope_1
-        st.session_state.x_new_1 = np.linspace(0, st.session_state.x1_min - 1, 100)
-        st.session_state.y_new_1 = st.session_state.x_new_1 * slope_1 + c_1
-
-        st.session_state.x2_max = df_test["p80"].iloc[-1]
-        slope_2 = f(st.session_state.x2_max, 1)
-        c_2 = df_test["Recovery"].iloc[-1] - slope_2 * st.session_state.x2_max
-        st.session_state.x0_2 = -c_2 / slope_2
-        st.session_state.x_new_2 = np.linspace(
-            st.session_state.x2_max + 1, st.session_state.x0_2, 100
-        )
-        st.session_state.y_new_2 = st.session_state.x_new_2 * slope_2 + c_2
-
-        prob = random.random()
-        norm.ppf(prob, loc=average_p80, scale=std_p80)
-        df_rand = pd.DataFrame(
-            np.random.random(size=(st.session_state.simul_number, 1)),
-            columns=["random"],
-        )
-        df_rand["Simulated_p80"] = norm.ppf(
-            df_rand["random"], loc=average_p80, scale=std_p80
-        )
-
-        def check(row):
-            if row["Simulated_p80"] < 35:
-                val = np.nan
-            elif row["Simulated_p80"] > st.session_state.x0_2:
-                val = np.nan
-            else:
-                val = row["Simulated_p80"]
-            return val
-
-        df_rand["Simulated_p80_check"] = df_rand.apply(check, axis=1)
-        df_rand["recovery"] = df_rand["Simulated_p80_check"].apply(f)
-
-        st.session_state.simul_recovery = df_rand[df_rand["recovery"] > 0][
-            "recovery"
-        ].mean()
-        st.session_state.simul_recovery = round(st.session_state.simul_recovery, 2)
-
-        st.session_state.df_rand = df_rand
-
-        with col41:
-            st.subheader("")
-            color1 = "#002A54"
-            #'midnightblue'
-            color2 = "#C94F7E"
-            #'purple'
-            plt.style.use("default")
-            x_new = np.linspace(st.session_state.x1_min, st.session_state.x2_max, 100)
-            y_new = f(x_new)
-            plt.rcParams.update({"font.size": 16})
-            fig1, ax = plt.subplots(figsize=(12, 8))
-            # ax2 = ax.twinx()
-            plt.grid(True, axis="y", linewidth=0.2, color="gray", linestyle="-")
-            ax.fill_between(x_new, y_new, alpha=0.1, color=color1, linewidth=2)
-            ax.fill_between(
-                st.session_state.x_new_1,
-                st.session_state.y_new_1,
-                alpha=0.1,
-                color=color1,
-                linewidth=2,
+        # ACÁ ESTÁ DEFINIDA LA CURVA ******************************************
+
+        # Spline natural entre los nodos y colas lineales tangentes fuera de
+        # ellos: la simulacion evalua exactamente la curva que se grafica
+        # Los nodos solo pasan a la sesion con una curva valida; si no, las
+        # otras paginas mezclarian la curva anterior con los nodos rechazados
+        try:
+            f = cache.cached_curve(df_test["p80"], df_test["Recovery"])
+            f.upper
+        except ValueError as error:
+            st.session_state.curve = None
+            st.error(str(error))
+            st.stop()
+        st.session_state.x = df_test["p80"]
+        st.session_state.y = df_test["Recovery"]
+        st.session_state.curve = f
+
+        # ACÁ ESTÁ DEFINIDA LA CURVA ******************************************
+
+        scenario = {
+            "mean": average_p80,
+            "std": std_p80,
+            "n": st.session_state.simul_number,
+            "seed": st.session_state.seed,
+            "sampler": st.session_state.sampler,
+            "truncate": st.session_state.truncate,
+            "shape": shape,
+            "upper": f.upper,
+        }
+        if st.session_state.calc_mode == CALC_MODES[1]:
+            simul_recovery = cached_simulation(
+                "expected_recovery",
+                f,
+                lambda: simulation.expected_recovery(
+                    f,
+                    average_p80,
+                    std_p80,
+                    upper=f.upper,
+                    shape=shape,
+                ),
+                mean=average_p80,
+                std=std_p80,
+                shape=shape,
+                upper=f.upper,
             )
-            ax.fill_between(
-                st.session_state.x_new_2,
-                st.session_state.y_new_2,
-                alpha=0.1,
-                color=color1,
-                linewidth=2,
+            std_error = 0.0
+            sim = {}
+            df_rand = None
+        elif stream_mode:
+            stream = simulation.simulate_stream(
+                f,
+                average_p80,
+                std_p80,
+                st.session_state.simul_number,
+                upper=f.upper,
+                sampler=st.session_state.sampler,
+                truncate=st.session_state.truncate,
+                shape=shape,
+                rng=np.random.default_rng(st.session_state.seed),
+                chunk_size=chunk_size,
+                tolerance=tolerance,
             )
-            ax.plot(x_new, y_new, linewidth=2, color=color1, alpha=0.8)
-            ax.plot(st.session_state.x, st.session_state.y, "o", color=color1)
-            ax.set_ylabel("Recovery", color=color1)
-            ax.set_xlabel("P80")
-            # plt.axhline(y = thr_mean, color = 'r', linestyle = '--',linewidth =0.4)
-            # fig1.text(0.7,0.4,'Average: '+str(round(thr_mean)),color='red',size=4)
-            plt.ylabel("", fontsize=16)
-            plt.xlabel("", fontsize=16)
-            ax.tick_params(axis="both", which="major", labelsize=16, width=0.2)
-            ax.spines["top"].set_linewidth("0.3")
-            ax.spines["right"].set_linewidth("0.3")
-            ax.spines["bottom"].set_linewidth("0.3")
-            ax.spines["left"].set_linewidth("0.3")
-            ax.set_ylim([0, 100])
-            ax.plot(
-                st.session_state.x_new_1,
-                st.session_state.y_new_1,
-                color=color1,
-                linewidth=2,
+            simul_recovery = np.nan
+            df_rand = None
+        elif st.session_state.simul_number >= parallel.PARALLEL_MIN_SAMPLES:
+            sim = cached_simulation(
+                "simulate_parallel",
+                f,
+                lambda: parallel.simulate_parallel(
+                    f,
+                    average_p80,
+                    std_p80,
+                    st.session_state.simul_number,
+                    upper=f.upper,
+                    seed=st.session_state.seed,
+                    sampler=st.session_state.sampler,
+                    truncate=st.session_state.truncate,
+                    shape=shape,
+                    workers=st.session_state.workers,
+                ),
+                **scenario,
             )
-
-            ax.plot(
-                st.session_state.x_new_2,
-                st.session_state.y_new_2,
-                color=color1,
-                linewidth=2,
+            simul_recovery = sim["simul_recovery"]
+            std_error = sim["std_error"]
+            df_rand = None
+        else:
+            sim = cached_simulation(
+                "simulate",
+                f,
+                lambda: simulation.simulate(
+                    f,
+                    average_p80,
+                    std_p80,
+                    st.session_state.simul_number,
+                    upper=f.upper,
+                    rng=np.random.default_rng(st.session_state.seed),
+                    sampler=st.session_state.sampler,
+                    truncate=st.session_state.truncate,
+                    shape=shape,
+                ),
+                **scenario,
             )
+            simul_recovery = sim["simul_recovery"]
+            std_error = sim["std_error"]
+            df_rand = simulation_frame(sim)
 
-            ## ESTE ES EL PEDAZO INSERTADO *********************************
-            x = np.array(df_test["p80"].tolist())
-            y = np.array(df_test["Recovery"].tolist())
-            spline = CubicSpline(x, y, bc_type="natural")
-
-            # Evaluar la spline en una serie de puntos más densos
-            tramo = x.max() - x.min()
-            x_new = np.linspace(x.min() - tramo * 0.05, x.max() + tramo * 0.05, 100)
-            y_new = spline(x_new)
-
-            # Graficar la curva
-            fig1, ax = plt.subplots(figsize=(12, 8))
-            ax2 = ax.twinx()
+        st.session_state.simul_recovery = round(simul_recovery, 2)
 
-            ax.plot(x, y, "o", label="Puntos Originales", markersize=15.0)
-            ax.plot(x_new, y_new, "-", label="Curva Ajustada", linewidth=3.0)
-            ax.set_xlabel("P80 (µm)", fontsize=22)
-            ax.set_ylabel("Recovery (%)", fontsize=22)
-            ax.tick_params(axis="both", labelsize=15)
-
-            ax.set_axisbelow(True)
-            ax.spines["bottom"].set_linewidth(2.0)
-            ax.spines["left"].set_linewidth(2.0)
+        st.session_state.df_rand = df_rand
 
-            ax2 = sns.histplot(
-                df_rand, x="Simulated_p80_check", bins=20, color=color2, linewidth=1.5
+        with col41:
+            st.subheader("")
+            chart = st.empty()
+            nodes = (
+                df_test["p80"].to_numpy(float),
+                df_test["Recovery"].to_numpy(float),
             )
-
-            ## ESTE ES EL PEDAZO INSERTADO ********************************
-
-            ax2.set_ylabel("Count", fontsize=22)  # , color=color2)
-
-            # plt.title('Curva Recuperación versus P80',fontsize=22)
-            st.pyplot(fig1)
+            points = charts.curve_points(f, nodes[0])
+            if stream_mode and st.session_state.calc_mode != CALC_MODES[1]:
+                for state in stream:
+                    if state["block"] % STREAM_REFRESH == 1 or state["done"]:
+                        counts, edges = state["hist"]
+                        distribution = ("Count", edges, counts.copy())
+                        # Los cuadros intermedios no se guardan en la cache compartida
+                        show_recovery_chart(
+                            chart, nodes, points, distribution, cached=state["done"]
+                        )
+                simul_recovery = state["simul_recovery"]
+                std_error = state["std_error"]
+                st.session_state.simul_recovery = round(simul_recovery, 2)
+            else:
+                if "hist" in sim:
+                    counts, edges = sim["hist"]
+                    distribution = ("Count", edges, counts)
+                elif df_rand is not None:
+                    distribution = charts.histogram(sim["Simulated_p80_check"])
+                else:
+                    distribution = charts.density(average_p80, std_p80, f.upper, shape)
+                show_recovery_chart(chart, nodes, points, distribution)
 
             metric(
                 "Simulated Recovery",
                 st.session_state.simul_recovery,
             )
+            metric("Standard Error", round(std_error, 4))
+            metric(
+                "P80 Window Probability",
+                round(
+                    float(
+                        simulation.window_mass(
+                            average_p80,
+                            std_p80,
+                            35,
+                            f.upper,
+                            shape,
+                        )
+                    ),
+                    4,
+                ),
+            )
+
+            with st.expander("Optimize Operating Point"):
+                # Busqueda directa sobre la recuperacion esperada exacta
+                if shape is not None:
+                    st.caption("The optimizer assumes a normal P80 distribution")
+                objective = st.radio("Objective", ("Recovery", "Revenue"))
+                std_max = st.number_input(
+                    "Maximum Standard Deviation P80",
+                    min_value=std_p80,
+                    value=std_p80,
+                    help="Equal to the current deviation to keep it fixed",
+                )
+                revenue = None
+                if objective == "Revenue":
+                    revenue = (
+                        st.number_input("Daily TPH", value=180000),
+                        st.number_input("Average Copper Grade (Percentage)", value=0.9),
+                        st.number_input("Copper Price (US$/lb)", value=4.86),
+                        st.number_input(
+                            "Feed F80",
+                            min_value=1000,
+                            value=10000,
+                            help="Throughput is scaled from the Daily TPH at the "
+                            "current Average P80 by Bond's law",
+                        ),
+                        average_p80,
+                    )
+                optimum = cache.cached(
+                    "optimal_p80",
+                    {
+                        "curve": f,
+                        "std": std_p80,
+                        "std_max": std_max,
+                        "revenue": revenue,
+                        "upper": f.upper,
+                    },
+                    lambda: optimizer.optimal_p80(
+                        f,
+                        std_p80,
+                        upper=f.upper,
+                        std_max=std_max,
+                        revenue=revenue,
+                        mean_bounds=(
+                            st.session_state.curve.node_min,
+                            st.session_state.curve.node_max,
+                        ),
+                    ),
+                )
+                st.info(
+                    f"Optimal Average P80: {round(optimum['average_p80'],1)} "
+                    f"(Standard Deviation P80: {round(optimum['std_p80'],1)})"
+                )
+                st.info(f"Expected Recovery: {round(optimum['recovery'],2)}%")
+                if revenue is not None:
+                    st.info(
+                        f"Yearly Copper Income: {round(optimum['value'],):,} US$/year"
+                    )
 
         def convert_df(df):
             return df.to_csv(sep=";", index=False).encode("latin-1")
@@ -513,72 +757,50 @@ def page_model():
                 )
 
         with col41:
-            import base64
-
-            def create_download_link(val, filename):
-                b64 = base64.b64encode(val)  # val looks like b'...'
-                return f'<a href="data:application/octet-stream;base64,{b64.decode()}" download="{filename}.pdf">Download file</a>'
-
-            export_as_pdf = st.button("Export Report")
-            if export_as_pdf:
-                pdf = FPDF(orientation="P", unit="mm", format="A4")
-                pdf.add_page()
-                pdf.set_font("Arial", "B", 16)
-                pdf.image("FLS1.jpg", x=180, y=0, w=30, h=30)
-                title = "Evaluation of Milling-Flotation Productivity Improvement Strategies"
-                intro = "    Many available control strategies are associated with individual improvements for Flotation or Grinding, and very few address the interrelationship between Grinding and Flotation in search of a global optimum. A methodology is presented to evaluate different control strategies focused on reducing the dispersion of the degree of liberation that can cause significant recovery losses. The method relies on historical P80 measurements in the plant, generating a statistical model that represents the plant data. At the same time, it makes use of a P80 versus Laboratory recovery curve and the Monte Carlo method to evaluate the impact on the recovery of different P80 distributions generated by different control strategies.    "
-                pdf.multi_cell(w=150, h=7, txt=title, border=0, align="J", fill="False")
-                # pdf.cell(40, 10, title)
-                pdf.set_font("Arial", "", 12)
-                pdf.ln(h="")
-                pdf.ln(h="")
-                pdf.ln(h="")
-                pdf.ln(h="")
-                # pdf.cell(60,23, intro,0, 1, 'C')
-                pdf.multi_cell(w=0, h=8, txt=intro, border=1, align="J", fill="False")
-                # ,str = 'J',bool = False)
-                # pdf.text(2, 25,intro)
-                fig1.savefig("fig1.jpg")
-                pdf.image("image2_en.png", x=50, y=140, w=130, h=90)
-                pdf.add_page()
-                pdf.set_font("Arial", "B", 16)
-                pdf.image("FLS1.jpg", x=180, y=0, w=30, h=30)
-                pdf.multi_cell(w=150, h=7, txt=title, border=0, align="J", fill="False")
-                pdf.set_font("Arial", "", 12)
-                pdf.text(20, 40, f"Parameters")
-                pdf.text(50, 50, f"Average P80: {str(average_p80)}")
-                pdf.text(50, 60, f"Standard Deviation P80: {str(std_p80)}")
-                pdf.text(50, 80, f"Number of Nodes: {str(node_number)}")
-                pdf.text(
-                    50,
-                    70,
-                    f"Number of Simulations: {str( st.session_state.simul_number)}",
+            if st.button("Export Report"):
+                st.session_state.report = report.submit(
+                    report.build_report,
+                    average_p80,
+                    std_p80,
+                    st.session_state.simul_number,
+                    nodes[0],
+                    nodes[1],
+                    charts.recovery_png(nodes, points, distribution),
+                    st.session_state.simul_recovery,
                 )
-                pdf.text(20, 95, f"Laboratory Recovery versus P80 Table")
-                pdf.set_font("Arial", "", 10)
-                for i in range(node_number):
-                    j = i + 1
-                    pdf.text(
-                        50,
-                        100 + j * 7,
-                        f"P80 {j}: {str(p80_list2[j])}  |  Recovery {j}: {rec_list[j]}",
+            show_report("report", "Download Report", "Report_P80.pdf")
+
+            with st.expander("Batch Reports"):
+                batch = st.data_editor(
+                    pd.DataFrame(
+                        {
+                            "Average P80": [average_p80],
+                            "Standard Deviation P80": [std_p80],
+                        }
+                    ),
+                    num_rows="dynamic",
+                    key="batch_scenarios",
+                ).dropna()
+                if st.button("Export Batch", disabled=batch.empty):
+                    st.session_state.report_batch = report.submit(
+                        report.build_batch,
+                        f,
+                        batch["Average P80"].to_numpy(float),
+                        batch["Standard Deviation P80"].to_numpy(float),
+                        st.session_state.simul_number,
+                        st.session_state.seed,
+                        {
+                            "sampler": st.session_state.sampler,
+                            "truncate": st.session_state.truncate,
+                            "shape": shape,
+                        },
+                        st.session_state.calc_mode == CALC_MODES[1],
+                        st.session_state.workers,
                     )
-
-                pdf.image("fig1.jpg", x=40, y=160, w=130, h=90)
-                pdf.set_font("Arial", "b", 16)
-                pdf.text(
-                    60,
-                    260,
-                    f"Simulated Recovery: {str(st.session_state.simul_recovery)}",
-                )
-
-                html = create_download_link(
-                    pdf.output(dest="S").encode("latin-1"), "Report_P80"
-                )
-
-                st.markdown(html, unsafe_allow_html=True)
+                show_report("report_batch", "Download Reports", "Reports_P80.zip")
 
     else:
+        st.session_state.curve = None
         with col41:
             st.write("")
             st.subheader("Los valores de P80 deben ser estrictamente crecientes")
@@ -593,12 +815,12 @@ def page_sensitivity():
         st.title("Evaluation of Milling-Flotation Productivity Improvement Strategies")
         st.write("")
     with col13:
-        image = Image.open("FLS1.jpg")
-        st.image(image, caption="OCS")
+        st.image(assets.logo(), caption="OCS")
         st.write("")
 
     st.subheader("Sensitivity Analysis")
     st.write("")
+    require_curve()
     col111, col112, col113, col114, col115 = st.columns((2, 3, 2, 3, 2))
 
     with col112:
@@ -615,6 +837,16 @@ def page_sensitivity():
         std_p80_max = st.number_input(
             "Maximum Standar deviation", min_value=0, max_value=300, value=30
         )
+    with col112:
+        mean_number = st.number_input(
+            "Number of mean P80 values", min_value=1, max_value=200, value=4
+        )
+    with col114:
+        number_sim = st.number_input(
+            "Number of Standar deviation values", min_value=2, max_value=500, value=20
+        )
+    with col112:
+        chart_type = st.selectbox("Chart Type", ("Lines", "Contour"))
 
     st.write("")
     st.write("")
@@ -622,330 +854,656 @@ def page_sensitivity():
 
     col211, col212, col213, col214, col215 = st.columns((1, 12, 1, 5, 1))
 
-    def check(row):
-        if row["Simulated_p80"] < 35:
-            val = np.nan
-        elif row["Simulated_p80"] > 350:
-            val = np.nan
-        else:
-            val = row["Simulated_p80"]
-        return val
-
     with col212:
         st.subheader("Recovery versus P80 Standar Deviation Graph")
         simul_number1 = st.session_state.simul_number
-
-        list_rec = []
-        list_std = []
-        list_mean = []
-        number_sim = 20
-        for j in range(1, 5):
-            average_p80 = mean_p80_min + (mean_p80_max - mean_p80_min) * (j - 1) / 3
-            list_mean.append(round(average_p80))
-            for i in range(0, number_sim):
-                std_aux = std_p80_min + (std_p80_max - std_p80_min) * i / (
-                    number_sim - 1
-                )
-                prob = random.random()
-                df_rand = pd.DataFrame(
-                    np.random.random(size=(simul_number1, 1)), columns=["random"]
-                )
-                df_rand["Simulated_p80"] = norm.ppf(
-                    df_rand["random"], loc=average_p80, scale=std_aux
-                )
-                df_rand["Simulated_p80_check"] = df_rand.apply(check, axis=1)
-                df_rand["recovery"] = df_rand["Simulated_p80_check"].apply(
-                    st.session_state.f
+        shape = st.session_state.get("p80_shape")
+
+        if chart_type == "Lines":
+            list_mean = np.linspace(mean_p80_min, mean_p80_max, mean_number)
+            list_std = np.linspace(std_p80_min, std_p80_max, number_sim)
+            if st.session_state.get("calc_mode") == CALC_MODES[1]:
+                list_rec = simulation.expected_recovery(
+                    st.session_state.curve,
+                    list_mean[:, None],
+                    list_std[None, :],
+                    upper=350,
+                    shape=shape,
+                ).round(2)
+            else:
+                sampler = st.session_state.get("sampler", simulation.SAMPLERS[0])
+                truncate = st.session_state.get("truncate", False)
+                seed = st.session_state.get("seed", 0)
+                list_rec = cached_simulation(
+                    "simulate_grid",
+                    st.session_state.curve,
+                    lambda: parallel.simulate_grid_parallel(
+                        st.session_state.curve,
+                        list_mean,
+                        list_std,
+                        simul_number1,
+                        upper=350,
+                        seed=seed,
+                        sampler=sampler,
+                        truncate=truncate,
+                        shape=shape,
+                        workers=st.session_state.get("workers", parallel.WORKERS),
+                    ),
+                    means=list_mean,
+                    stds=list_std,
+                    n=simul_number1,
+                    seed=seed,
+                    sampler=sampler,
+                    truncate=truncate,
+                    shape=shape,
+                    upper=350,
+                ).round(2)
+            fig2, ax = figures.new_figure(figsize=(12, 8), grid=True)
+            for i in range(mean_number):
+                # plt.style.use('bmh')
+                ax.plot(
+                    list_std,
+                    list_rec[i],
+                    linewidth=2,
+                    alpha=0.8,
+                    label=f"P80 mean : {round(list_mean[i])}",
                 )
-                simul_recovery_aux = df_rand[df_rand["recovery"] > 0]["recovery"].mean()
-                simul_recovery_aux = round(simul_recovery_aux, 2)
-                list_rec.append(simul_recovery_aux)
-                list_std.append(std_aux)
-        list_mean2 = [str(i) for i in list_mean]
-        mystring = "P80 mean : "
-        list_mean3 = [mystring + s for s in list_mean2]
-        fig2, ax = plt.subplots(figsize=(12, 8))
-        # plt.style.use('bmh')
-        plt.grid(True, axis="y", linewidth=0.2, color="gray", linestyle="-")
-        for i in range(4):
-            # plt.style.use('bmh')
-            ax.plot(
-                list_std[i * number_sim : i * number_sim + number_sim],
-                list_rec[i * number_sim : i * number_sim + number_sim],
-                linewidth=2,
-                alpha=0.8,
-                label=list_mean3[i],
+            if mean_number <= 10:
+                ax.legend()
+            # color=color1,
+            # ax.plot(x, y, 'o', color=color1)
+            ax.set_ylabel("Recovery")
+            ax.set_xlabel("P80 Standar Deviation")
+            figures.show(st, fig2)
+
+        if chart_type == "Contour":
+            # Superficie de respuesta densa calculada por convolucion FFT
+            grid_mean = np.linspace(mean_p80_min, mean_p80_max, 200)
+            grid_std = np.linspace(std_p80_min, std_p80_max, 200)
+            surface = simulation.response_surface(
+                st.session_state.curve, grid_mean, grid_std, upper=350, shape=shape
             )
-            ax.legend()
-        # color=color1,
-        # ax.plot(x, y, 'o', color=color1)
-        ax.set_ylabel("Recovery")
-        ax.set_xlabel("P80 Standar Deviation")
-        st.pyplot(fig2)
-        # plt.plot(list_std,list_rec)
-
-
-def page_eco():
-    simul_number2 = 1000
-
+            fig3, ax = figures.new_figure(figsize=(12, 8))
+            contour = ax.contourf(
+                grid_std, grid_mean, surface, levels=20, cmap="viridis"
+            )
+            ax.contour(
+                grid_std, grid_mean, surface, levels=20, colors="k", linewidths=0.3
+            )
+            fig3.colorbar(contour, ax=ax, label="Recovery")
+            ax.set_ylabel("P80 mean")
+            ax.set_xlabel("P80 Standar Deviation")
+            figures.show(st, fig3)
+
+
+def series_recovery(
+    average_p80, std_p80, time_constant, ma, days, replicates, shift_hours, seed
+):
+    # Trayectorias de P80 a resolucion de 1 minuto, generadas por bloques
+    progress = st.progress(0.0, text="Simulating P80 trajectories")
+    steps = int(days * 1440)
+    for state in simulation.simulate_series(
+        st.session_state.curve,
+        average_p80,
+        std_p80,
+        steps,
+        replicates,
+        upper=st.session_state.curve.upper,
+        ar=(np.exp(-1 / time_constant),),
+        ma=(ma,) if ma else (),
+        rng=np.random.default_rng(seed),
+        periods=(("shift", int(shift_hours * 60)), ("day", 1440)),
+    ):
+        progress.progress(state["steps"] / steps)
+    progress.empty()
+    return {key: state[key] for key in ("shift", "day", "simul_recovery")}
+
+
+def page_series():
     col11, col12, col13 = st.columns((1, 8, 1.5))
 
     with col12:
-        st.title("Economic Evaluation")
-        # st.write("")
+        st.title("Evaluation of Milling-Flotation Productivity Improvement Strategies")
+        st.write("")
     with col13:
-        image = Image.open("FLS1.jpg")
-        st.image(image, caption="OCS")
+        st.image(assets.logo(), caption="OCS")
         st.write("")
 
-    cola1, cola2, cola3 = st.columns((1, 8, 1))
-    with cola2:
+    st.subheader("Time Series Simulation")
+    st.write("")
+    require_curve()
+    col111, col112, col113, col114, col115 = st.columns((2, 3, 2, 3, 2))
+
+    with col112:
         average_p80 = st.number_input(
             "Average P80", min_value=35, max_value=300, value=180
         )
-        std_p80_1 = st.number_input("Standard Deviation P80 - 1", min_value=1, value=35)
-        std_p80_2 = st.number_input("Standard Deviation P80 - 2", min_value=1, value=15)
-        ton_diario = st.number_input("Daily TPH", value=180000)
-        ley = st.number_input("Average Copper Grade (Percentage)", value=0.9)
-        precio = st.number_input("Copper Price (US$/lb)", value=4.86)
-    st.write("")
-    col21, col22, col23 = st.columns((8, 2, 8))
-    with col21:
-        st.subheader("")
-
-        prob = random.random()
-        norm.ppf(prob, loc=average_p80, scale=std_p80_1)
-        df_rand = pd.DataFrame(
-            np.random.random(size=(simul_number2, 1)), columns=["random"]
+        std_p80 = st.number_input("Standard Deviation P80", min_value=1, value=35)
+        time_constant = st.number_input(
+            "Disturbance Time Constant (minutes)",
+            min_value=1.0,
+            value=60.0,
+            help="How long the circuit takes to reject a P80 disturbance",
         )
-        df_rand["Simulated_p80"] = norm.ppf(
-            df_rand["random"], loc=average_p80, scale=std_p80_1
+        ma = st.number_input("Moving Average Coefficient", value=0.0)
+    with col114:
+        days = st.number_input("Simulated Days", min_value=1, max_value=365, value=30)
+        replicates = st.number_input(
+            "Number of Replicates", min_value=1, max_value=1000, value=100
         )
+        shift_hours = st.selectbox("Shift Length (hours)", (8, 12), index=0)
+        seed = st.number_input("Random Seed", min_value=0, value=0)
+
+    params = {
+        "average_p80": average_p80,
+        "std_p80": std_p80,
+        "time_constant": time_constant,
+        "ma": ma,
+        "days": days,
+        "replicates": replicates,
+        "shift_hours": shift_hours,
+        "seed": seed,
+    }
+    result = cached_simulation(
+        "simulate_series",
+        st.session_state.curve,
+        lambda: series_recovery(**params),
+        upper=st.session_state.curve.upper,
+        **params,
+    )
 
-        def check(row):
-            if row["Simulated_p80"] < 35:
-                val = np.nan
-            elif row["Simulated_p80"] > st.session_state.x0_2:
-                val = np.nan
-            else:
-                val = row["Simulated_p80"]
-            return val
-
-        df_rand["Simulated_p80_check"] = df_rand.apply(check, axis=1)
-        df_rand["recovery"] = df_rand["Simulated_p80_check"].apply(st.session_state.f)
-
-        st.session_state.simul_recovery = df_rand[df_rand["recovery"] > 0][
-            "recovery"
-        ].mean()
-
-        st.session_state.simul_recovery = round(st.session_state.simul_recovery, 2)
+    st.write("")
+    col211, col212, col213, col214, col215 = st.columns((1, 12, 1, 5, 1))
+    color1 = "#002A54"
+    color2 = "#C94F7E"
+    with col212:
+        fig6, (ax, ax2) = figures.new_figure(figsize=(16, 6), ncols=2)
+        for values, color, label in (
+            (result["shift"], color1, "Shift"),
+            (result["day"], color2, "Day"),
+        ):
+            values = values[np.isfinite(values)]
+            ax.hist(values, bins=40, density=True, alpha=0.6, color=color, label=label)
+        ax.set_xlabel("Recovery")
+        ax.set_ylabel("Density")
+        ax.legend()
+        day = np.arange(1, result["day"].shape[1] + 1)
+        for row in result["day"][:5]:
+            ax2.plot(day, row, color=color1, alpha=0.6, linewidth=1)
+        ax2.set_xlabel("Day")
+        ax2.set_ylabel("Daily Recovery")
+        figures.show(st, fig6)
+    with col214:
+        metric("Simulated Recovery", round(result["simul_recovery"], 2))
+        for name, label in (("shift", "Shift"), ("day", "Daily")):
+            p10, p50, p90 = np.nanpercentile(result[name], [10, 50, 90])
+            st.info(
+                f"{label} Recovery P10 / P50 / P90: "
+                f"{round(p10,2)}% / {round(p50,2)}% / {round(p90,2)}%"
+            )
 
-        st.session_state.df_rand = df_rand
 
-        color1 = "#002A54"
-        #'midnightblue'
-        color2 = "#C94F7E"
-        #'purple'
-        plt.style.use("default")
-        x_new = np.linspace(st.session_state.x1_min, st.session_state.x2_max, 100)
-        y_new = st.session_state.f(x_new)
-        plt.rcParams.update({"font.size": 16})
-        fig1, ax = plt.subplots(figsize=(12, 8))
-        ax2 = ax.twinx()
-        plt.grid(True, axis="y", linewidth=0.2, color="gray", linestyle="-")
-        ax.fill_between(x_new, y_new, alpha=0.1, color=color1, linewidth=2)
-        ax.fill_between(
-            st.session_state.x_new_1,
-            st.session_state.y_new_1,
-            alpha=0.1,
-            color=color1,
-            linewidth=2,
+def eco_curve(p80, recovery):
+    return cache.cached_curve(p80, recovery)
+
+
+def eco_sampling(
+    curve,
+    average_p80,
+    std_p80_1,
+    std_p80_2,
+    n,
+    seed,
+    sampler,
+    truncate,
+    shape,
+    upper,
+    mode,
+):
+    # Ambas estrategias usan los mismos numeros aleatorios (common random numbers)
+    if mode == CALC_MODES[1]:
+        return None
+    return cached_simulation(
+        "simulate_scenarios",
+        curve,
+        lambda: simulation.simulate_scenarios(
+            curve,
+            [average_p80, average_p80],
+            [std_p80_1, std_p80_2],
+            n,
+            upper=upper,
+            rng=np.random.default_rng(seed),
+            sampler=sampler,
+            truncate=truncate,
+            shape=shape,
+        ),
+        means=[average_p80, average_p80],
+        stds=[std_p80_1, std_p80_2],
+        n=n,
+        seed=seed,
+        sampler=sampler,
+        truncate=truncate,
+        shape=shape,
+        upper=upper,
+    )
+
+
+def eco_recovery(
+    curve, sampling, average_p80, std_p80_1, std_p80_2, shape, upper, mode
+):
+    if mode == CALC_MODES[1]:
+        recoveries = simulation.expected_recovery(
+            curve,
+            average_p80,
+            np.array([std_p80_1, std_p80_2]),
+            upper=upper,
+            shape=shape,
         )
-        ax.fill_between(
-            st.session_state.x_new_2,
-            st.session_state.y_new_2,
-            alpha=0.1,
-            color=color1,
-            linewidth=2,
+        rec_dif = recoveries[1] - recoveries[0]
+        return recoveries, rec_dif, (rec_dif, rec_dif)
+    rec_dif, rec_dif_ci = simulation.recovery_difference(sampling, 0, 1)
+    return sampling["simul_recovery"], rec_dif, rec_dif_ci
+
+
+def eco_histogram(sampling, upper):
+    if sampling is None:
+        return (None, None)
+    edges = np.linspace(35, upper, 21)
+    return tuple(
+        (np.histogram(p80[~np.isnan(p80)], bins=edges)[0], edges)
+        for p80 in sampling["Simulated_p80_check"]
+    )
+
+
+def eco_economics(recovery, ton_diario, ley, precio):
+    rec_dif, rec_dif_ci = recovery[1], recovery[2]
+    cobre_ad, ppd, us_day, us_year = economics.additional_income(
+        rec_dif, ton_diario, ley, precio
+    )
+    us_year_ci = [
+        economics.additional_income(d, ton_diario, ley, precio)[3] for d in rec_dif_ci
+    ]
+    return cobre_ad, ppd, us_day, us_year, us_year_ci
+
+
+def eco_sweep_grid(rec_dif, rec_dif_ci, prices, grades, tphs):
+    return economics.income_grid(rec_dif, rec_dif_ci, prices, grades, tphs)
+
+
+def eco_sweep_heatmap(grid, tph):
+    table = grid[grid["Daily TPH"] == tph]
+    prices = np.unique(table["Copper Price (US$/lb)"])
+    grades = np.unique(table["Copper Grade (%)"])
+    values = (
+        table.pivot(
+            index="Copper Grade (%)", columns="Copper Price (US$/lb)", values="US$/year"
         )
-        ax.plot(x_new, y_new, linewidth=2, color=color1, alpha=0.8)
-        ax.plot(st.session_state.x, st.session_state.y, "o", color=color1)
-        ax.set_ylabel("Recovery", color=color1)
-        ax.set_xlabel("P80")
-        # plt.axhline(y = thr_mean, color = 'r', linestyle = '--',linewidth =0.4)
-        # fig1.text(0.7,0.4,'Average: '+str(round(thr_mean)),color='red',size=4)
-        plt.ylabel("", fontsize=16)
-        plt.xlabel("", fontsize=16)
-        ax.tick_params(axis="both", which="major", labelsize=16, width=0.2)
-        ax.spines["top"].set_linewidth("0.3")
-        ax.spines["right"].set_linewidth("0.3")
-        ax.spines["bottom"].set_linewidth("0.3")
-        ax.spines["left"].set_linewidth("0.3")
-        ax.set_ylim([0, 100])
-
-        fig1, ax = plt.subplots(figsize=(12, 8))
+        .loc[grades, prices]
+        .to_numpy()
+    )
+    fig4, ax = figures.new_figure(figsize=(12, 6))
+    mesh = ax.pcolormesh(prices, grades, values / 1e6, shading="nearest", cmap="RdYlGn")
+    fig4.colorbar(mesh, ax=ax, label="Additional Yearly Income (MUS$/year)")
+    ax.set_xlabel("Copper Price (US$/lb)")
+    ax.set_ylabel("Average Copper Grade (Percentage)")
+    ax.set_title(f"Daily TPH: {tph:,.0f}")
+    return figures.to_png(fig4)
+
+
+def eco_rendering(histogram, average_p80, std_p80_1, std_p80_2, tails, shape):
+    color1 = "#002A54"
+    #'midnightblue'
+    color2 = "#C94F7E"
+    #'purple'
+    x_new_1, y_new_1, x_new_2, y_new_2 = tails
+    images = []
+    for i, std_p80 in enumerate((std_p80_1, std_p80_2)):
+        fig1, ax = figures.new_figure(figsize=(12, 8))
         ax2 = ax.twinx()
-        ax.plot(
-            st.session_state.x_new_1,
-            st.session_state.y_new_1,
-            color=color1,
-            linewidth=2,
-        )
-        ax.plot(
-            st.session_state.x_new_2,
-            st.session_state.y_new_2,
-            color=color1,
-            linewidth=2,
-        )
-        ax2 = sns.histplot(
-            st.session_state.df_rand,
-            x="Simulated_p80_check",
-            bins=20,
-            color=color2,
-        )
-        ax2.set_ylabel("Count", color=color2)
-        ax.text(ax.get_xlim()[1] * 0.8, 90, f"std 1: {std_p80_1}")
-
+        ax.plot(x_new_1, y_new_1, color=color1, linewidth=2)
+        ax.plot(x_new_2, y_new_2, color=color1, linewidth=2)
+        if histogram[i] is None:
+            distribution = charts.density(average_p80, std_p80, x_new_2[-1], shape)
+        else:
+            counts, edges = histogram[i]
+            distribution = ("Count", edges, counts)
+        label = charts.draw_distribution(ax2, distribution, color2)
+        ax2.set_ylabel(label, color=color2)
+        ax.text(ax.get_xlim()[1] * 0.8, 90, f"std {i + 1}: {std_p80}")
         # plt.title('Curva Recuperación versus P80',fontsize=22)
-
-        ## ESTE ES EL PEDAZO INSERTADO
-        # Create a figure and an axis
-        # fig1, ax = plt.subplots(figsize=(12, 8))
-
-        # Add a line to the axis
-        # ax.plot([1, 2, 3], [4, 5, 6])
-        ## ESTE ES EL PEDAZO INSERTADO
-
-        st.pyplot(fig1)
-
-        metric(
-            "Simulated Recovery",
-            st.session_state.simul_recovery,
-        )
-
-    with col23:
-        st.subheader("")
-
-        prob = random.random()
-        norm.ppf(prob, loc=average_p80, scale=std_p80_2)
-        df_rand = pd.DataFrame(
-            np.random.random(size=(simul_number2, 1)), columns=["random"]
+        # Se guarda la imagen ya renderizada para no volver a dibujarla
+        images.append(figures.to_png(fig1))
+    return images
+
+
+def compare_recovery(
+    curve, means, stds, n, seed, sampler, truncate, shape, upper, mode, baseline=0
+):
+    # Todas las estrategias en una sola pasada, con los mismos numeros aleatorios
+    if mode == CALC_MODES[1]:
+        recoveries = simulation.expected_recovery(
+            curve, means, stds, upper=upper, shape=shape
         )
-        df_rand["Simulated_p80"] = norm.ppf(
-            df_rand["random"], loc=average_p80, scale=std_p80_2
-        )
-
-        def check(row):
-            if row["Simulated_p80"] < 35:
-                val = np.nan
-            elif row["Simulated_p80"] > st.session_state.x0_2:
-                val = np.nan
-            else:
-                val = row["Simulated_p80"]
-            return val
-
-        df_rand["Simulated_p80_check"] = df_rand.apply(check, axis=1)
-        df_rand["recovery"] = df_rand["Simulated_p80_check"].apply(st.session_state.f)
+        difference = recoveries - recoveries[baseline]
+        comparison = {
+            "simul_recovery": recoveries,
+            "std_error": np.zeros_like(recoveries),
+            "difference": difference,
+            "difference_low": difference,
+            "difference_high": difference,
+        }
+        return comparison, None
+    sim = cached_simulation(
+        "simulate_scenarios",
+        curve,
+        lambda: simulation.simulate_scenarios(
+            curve,
+            means,
+            stds,
+            n,
+            upper=upper,
+            rng=np.random.default_rng(seed),
+            sampler=sampler,
+            truncate=truncate,
+            shape=shape,
+        ),
+        means=means,
+        stds=stds,
+        n=n,
+        seed=seed,
+        sampler=sampler,
+        truncate=truncate,
+        shape=shape,
+        upper=upper,
+    )
+    edges = np.linspace(35, upper, 41)
+    hists = [
+        np.histogram(p80[~np.isnan(p80)], bins=edges, density=True)[0]
+        for p80 in sim["Simulated_p80_check"]
+    ]
+    return simulation.compare_strategies(sim, baseline), (np.array(hists), edges)
+
+
+def compare_table(recovery, names, means, stds, ton_diario, ley, precio):
+    return economics.strategy_table(
+        names, means, stds, recovery[0], ton_diario, ley, precio
+    )
+
+
+def compare_chart(recovery, names, means, stds, tails, shape, upper):
+    color1 = "#002A54"
+    x_new_1, y_new_1, x_new_2, y_new_2 = tails
+    colors = figures.colors(len(names))
+    hists = recovery[1]
+
+    fig5, ax = figures.new_figure(figsize=(12, 6))
+    ax2 = ax.twinx()
+    ax.plot(x_new_1, y_new_1, color=color1, linewidth=2)
+    ax.plot(x_new_2, y_new_2, color=color1, linewidth=2)
+    x_pdf = np.linspace(35, upper, 200)
+    for i, (name, mean, std) in enumerate(zip(names, means, stds)):
+        label = f"{name} ({recovery[0]['simul_recovery'][i]:.2f}%)"
+        if hists is None:
+            density = simulation.p80_pdf(x_pdf, mean, std, shape)
+            ax2.plot(x_pdf, density, color=colors[i], label=label)
+        else:
+            ax2.stairs(hists[0][i], hists[1], color=colors[i], label=label)
+    ax.set_xlabel("P80")
+    ax.set_ylabel("Recovery", color=color1)
+    ax2.set_ylabel("Density")
+    ax2.legend(loc="upper right")
+    return figures.to_png(fig5)
+
+
+ECO_COMPARE_PIPELINE = pipeline.Pipeline(
+    "eco_compare",
+    [
+        pipeline.Stage("curve", eco_curve, inputs=("p80", "recovery")),
+        pipeline.Stage(
+            "recovery",
+            compare_recovery,
+            inputs=(
+                "means",
+                "stds",
+                "n",
+                "seed",
+                "sampler",
+                "truncate",
+                "shape",
+                "upper",
+                "mode",
+            ),
+            after=("curve",),
+        ),
+        pipeline.Stage(
+            "table",
+            compare_table,
+            inputs=("names", "means", "stds", "ton_diario", "ley", "precio"),
+            after=("recovery",),
+        ),
+        pipeline.Stage(
+            "chart",
+            compare_chart,
+            inputs=("names", "means", "stds", "tails", "shape", "upper"),
+            after=("recovery",),
+        ),
+    ],
+)
+
+
+def bootstrap_curves(p80, recovery, error, replicates, seed):
+    return simulation.curve_ensemble(
+        p80, recovery, error, replicates, np.random.default_rng(seed)
+    )
+
+
+def bootstrap_recovery(
+    curves, average_p80, std_p80_1, std_p80_2, n, seed, sampler, truncate, shape, upper
+):
+    # Las mismas muestras de P80 para todas las curvas y ambas estrategias
+    return simulation.ensemble_recovery(
+        curves,
+        [average_p80, average_p80],
+        [std_p80_1, std_p80_2],
+        n,
+        upper=upper,
+        rng=np.random.default_rng(seed),
+        sampler=sampler,
+        truncate=truncate,
+        shape=shape,
+    )
+
+
+def bootstrap_band(recovery, ton_diario, ley, precio):
+    difference = recovery[1] - recovery[0]
+    us_year = economics.additional_income(difference, ton_diario, ley, precio)[3]
+    percentiles = (2.5, 50, 97.5)
+    return {
+        "recovery": np.percentile(recovery, percentiles, axis=1).T,
+        "difference": np.percentile(difference, percentiles),
+        "us_year": np.percentile(us_year, percentiles),
+        "us_year_values": us_year,
+    }
+
+
+def bootstrap_chart(band):
+    color1 = "#002A54"
+    fig7, ax = figures.new_figure(figsize=(12, 4))
+    ax.hist(band["us_year_values"] / 1e6, bins=40, color=color1, alpha=0.8)
+    for value in band["us_year"][[0, 2]] / 1e6:
+        ax.axvline(value, color="#C94F7E", linestyle="--")
+    ax.set_xlabel("Additional Yearly Income (MUS$/year)")
+    ax.set_ylabel("Curves")
+    return figures.to_png(fig7)
+
+
+ECO_BOOTSTRAP_PIPELINE = pipeline.Pipeline(
+    "eco_bootstrap",
+    [
+        pipeline.Stage(
+            "curves",
+            bootstrap_curves,
+            inputs=("p80", "recovery", "error", "replicates", "seed"),
+        ),
+        pipeline.Stage(
+            "recovery",
+            bootstrap_recovery,
+            inputs=(
+                "average_p80",
+                "std_p80_1",
+                "std_p80_2",
+                "n",
+                "seed",
+                "sampler",
+                "truncate",
+                "shape",
+                "upper",
+            ),
+            after=("curves",),
+        ),
+        pipeline.Stage(
+            "band",
+            bootstrap_band,
+            inputs=("ton_diario", "ley", "precio"),
+            after=("recovery",),
+        ),
+        pipeline.Stage("chart", bootstrap_chart, after=("band",)),
+    ],
+)
+
+
+ECO_SWEEP_PIPELINE = pipeline.Pipeline(
+    "eco_sweep",
+    [
+        pipeline.Stage(
+            "grid",
+            eco_sweep_grid,
+            inputs=("rec_dif", "rec_dif_ci", "prices", "grades", "tphs"),
+        ),
+        pipeline.Stage("heatmap", eco_sweep_heatmap, inputs=("tph",), after=("grid",)),
+    ],
+)
+
+
+# Cada etapa declara sus entradas; solo se recalcula lo que esta aguas abajo
+# de un cambio (por ejemplo, el precio del cobre solo recalcula la economia).
+ECO_PIPELINE = pipeline.Pipeline(
+    "eco",
+    [
+        pipeline.Stage("curve", eco_curve, inputs=("p80", "recovery")),
+        pipeline.Stage(
+            "sampling",
+            eco_sampling,
+            inputs=(
+                "average_p80",
+                "std_p80_1",
+                "std_p80_2",
+                "n",
+                "seed",
+                "sampler",
+                "truncate",
+                "shape",
+                "upper",
+                "mode",
+            ),
+            after=("curve",),
+        ),
+        pipeline.Stage(
+            "recovery",
+            eco_recovery,
+            inputs=("average_p80", "std_p80_1", "std_p80_2", "shape", "upper", "mode"),
+            after=("curve", "sampling"),
+        ),
+        pipeline.Stage(
+            "histogram", eco_histogram, inputs=("upper",), after=("sampling",)
+        ),
+        pipeline.Stage(
+            "economics",
+            eco_economics,
+            inputs=("ton_diario", "ley", "precio"),
+            after=("recovery",),
+        ),
+        pipeline.Stage(
+            "rendering",
+            eco_rendering,
+            inputs=("average_p80", "std_p80_1", "std_p80_2", "tails", "shape"),
+            after=("histogram",),
+        ),
+    ],
+)
 
-        st.session_state.simul_recovery2 = df_rand[df_rand["recovery"] > 0][
-            "recovery"
-        ].mean()
-        st.session_state.simul_recovery2 = round(st.session_state.simul_recovery2, 2)
 
-        max_p80 = df_rand["Simulated_p80_check"].max()
+def page_eco():
+    col11, col12, col13 = st.columns((1, 8, 1.5))
 
-        st.session_state.df_rand = df_rand
+    with col12:
+        st.title("Economic Evaluation")
+        # st.write("")
+    with col13:
+        st.image(assets.logo(), caption="OCS")
+        st.write("")
+    require_curve()
 
-        color1 = "#002A54"
-        #'midnightblue'
-        color2 = "#C94F7E"
-        #'purple'
-        plt.style.use("default")
-        x_new = np.linspace(st.session_state.x1_min, st.session_state.x2_max, 100)
-        y_new = st.session_state.f(x_new)
-        plt.rcParams.update({"font.size": 16})
-        fig1, ax = plt.subplots(figsize=(12, 8))
-        ax2 = ax.twinx()
-        plt.grid(True, axis="y", linewidth=0.2, color="gray", linestyle="-")
-        ax.fill_between(x_new, y_new, alpha=0.1, color=color1, linewidth=2)
-        ax.fill_between(
-            st.session_state.x_new_1,
-            st.session_state.y_new_1,
-            alpha=0.1,
-            color=color1,
-            linewidth=2,
-        )
-        ax.fill_between(
-            st.session_state.x_new_2,
-            st.session_state.y_new_2,
-            alpha=0.1,
-            color=color1,
-            linewidth=2,
-        )
-        ax.plot(x_new, y_new, linewidth=2, color=color1, alpha=0.8)
-        ax.plot(st.session_state.x, st.session_state.y, "o", color=color1)
-        ax.set_ylabel("Recovery", color=color1)
-        ax.set_xlabel("P80")
-        # plt.axhline(y = thr_mean, color = 'r', linestyle = '--',linewidth =0.4)
-        # fig1.text(0.7,0.4,'Average: '+str(round(thr_mean)),color='red',size=4)
-        plt.ylabel("", fontsize=16)
-        plt.xlabel("", fontsize=16)
-        ax.tick_params(axis="both", which="major", labelsize=16, width=0.2)
-        ax.spines["top"].set_linewidth("0.3")
-        ax.spines["right"].set_linewidth("0.3")
-        ax.spines["bottom"].set_linewidth("0.3")
-        ax.spines["left"].set_linewidth("0.3")
-        ax.set_ylim([0, 100])
-
-        fig1, ax = plt.subplots(figsize=(12, 8))
-        ax2 = ax.twinx()
-        ax.plot(
-            st.session_state.x_new_1,
-            st.session_state.y_new_1,
-            color=color1,
-            linewidth=2,
-        )
-        ax.plot(
-            st.session_state.x_new_2,
-            st.session_state.y_new_2,
-            color=color1,
-            linewidth=2,
+    cola1, cola2, cola3 = st.columns((1, 8, 1))
+    with cola2:
+        average_p80 = st.number_input(
+            "Average P80", min_value=35, max_value=300, value=180
         )
-        ax2 = sns.histplot(
-            st.session_state.df_rand,
-            x="Simulated_p80_check",
-            bins=20,
-            color=color2,
+        std_p80_1 = st.number_input("Standard Deviation P80 - 1", min_value=1, value=35)
+        std_p80_2 = st.number_input("Standard Deviation P80 - 2", min_value=1, value=15)
+        ton_diario = st.number_input("Daily TPH", value=180000)
+        ley = st.number_input("Average Copper Grade (Percentage)", value=0.9)
+        precio = st.number_input("Copper Price (US$/lb)", value=4.86)
+        simul_number2 = st.number_input(
+            "Number of Simulations", min_value=2, value=100000
         )
-        ax2.set_ylabel("Count", color=color2)
-        ax.text(ax.get_xlim()[1] * 0.8, 90, f"std 2: {std_p80_2}")
-        # plt.title('Curva Recuperación versus P80',fontsize=22)
-
-        ## ESTE ES EL PEDAZO INSERTADO
-        # Create a figure and an axis
-        # fig1, ax = plt.subplots(figsize=(12, 8))
-
-        # Add a line to the axis
-        # ax.plot([1, 2, 3], [4, 5, 6])
-        ## ESTE ES EL PEDAZO INSERTADO
+        seed = st.number_input("Random Seed", min_value=0, value=0)
+    st.write("")
 
-        st.pyplot(fig1)
-        # st.write(ax.get_xlim()[1])
+    results, recomputed = ECO_PIPELINE.run(
+        st.session_state,
+        p80=np.asarray(st.session_state.x, dtype=float),
+        recovery=np.asarray(st.session_state.y, dtype=float),
+        average_p80=average_p80,
+        std_p80_1=std_p80_1,
+        std_p80_2=std_p80_2,
+        n=simul_number2,
+        seed=seed,
+        sampler=st.session_state.get("sampler", simulation.SAMPLERS[0]),
+        truncate=st.session_state.get("truncate", False),
+        shape=st.session_state.get("p80_shape"),
+        upper=st.session_state.curve.upper,
+        mode=st.session_state.get("calc_mode", CALC_MODES[0]),
+        ton_diario=ton_diario,
+        ley=ley,
+        precio=precio,
+        tails=st.session_state.curve.tails(),
+    )
+    recoveries, rec_dif, rec_dif_ci = results["recovery"]
+    cobre_ad, ppd, us_day, us_year, us_year_ci = results["economics"]
+    st.session_state.simul_recovery = round(recoveries[0], 2)
+    st.session_state.simul_recovery2 = round(recoveries[1], 2)
 
-        metric(
-            "Simulated Recovery",
-            st.session_state.simul_recovery2,
-        )
+    col21, col22, col23 = st.columns((8, 2, 8))
+    for col, fig1, simul_recovery in zip(
+        (col21, col23),
+        results["rendering"],
+        (st.session_state.simul_recovery, st.session_state.simul_recovery2),
+    ):
+        with col:
+            st.subheader("")
+            st.image(fig1)
+            metric(
+                "Simulated Recovery",
+                simul_recovery,
+            )
 
     col31, col32, col33 = st.columns((2, 8, 2))
-    rec_dif = st.session_state.simul_recovery2 - st.session_state.simul_recovery
-    cobre_ad = ton_diario * ley / 100 * rec_dif / 100
-    ppd = cobre_ad * 2204.63
-    us_day = ppd * precio
-    us_year = us_day * 365
-
     with col32:
-        st.info(f"Recovery Difference: {round(rec_dif,2)}%")
+        st.info(
+            f"Recovery Difference: {round(rec_dif,2)}% "
+            f"(95% CI: {round(rec_dif_ci[0],2)}% to {round(rec_dif_ci[1],2)}%)"
+        )
         st.info(f"Daily Tons of Additional Fine Copper: {round(cobre_ad,2)} tpd")
         st.info(f"Pounds per day: {round(ppd,),:}")
         if us_day > 0:
@@ -954,6 +1512,144 @@ def page_eco():
         else:
             st.error(f"Additional Daily Income: {round(us_day,):,} US$/day")
             st.error(f"Additional Yearly Income: {round(us_year,):,} US$/year")
+        st.info(
+            f"Yearly Income 95% CI: {round(us_year_ci[0],):,} to "
+            f"{round(us_year_ci[1],):,} US$/year"
+        )
+        st.caption("Recomputed stages: " + (", ".join(recomputed) or "none"))
+
+    with col32:
+        with st.expander("Economic Sensitivity Sweep"):
+            # Una sola diferencia de recuperacion evaluada sobre toda la grilla
+            colp, colg, colt = st.columns(3)
+            with colp:
+                price_min = st.number_input("Minimum Copper Price", value=3.5)
+                price_max = st.number_input("Maximum Copper Price", value=5.5)
+                price_steps = st.number_input("Price Values", min_value=2, value=21)
+            with colg:
+                grade_min = st.number_input("Minimum Copper Grade", value=0.5)
+                grade_max = st.number_input("Maximum Copper Grade", value=1.2)
+                grade_steps = st.number_input("Grade Values", min_value=2, value=15)
+            with colt:
+                tph_min = st.number_input("Minimum Daily TPH", value=150000)
+                tph_max = st.number_input("Maximum Daily TPH", value=200000)
+                tph_steps = st.number_input("TPH Values", min_value=1, value=5)
+            tphs = np.linspace(tph_min, tph_max, tph_steps)
+            tph = st.select_slider(
+                "Daily TPH for the Heatmap",
+                options=list(tphs),
+                format_func=lambda value: f"{value:,.0f}",
+            )
+            sweep, _ = ECO_SWEEP_PIPELINE.run(
+                st.session_state,
+                rec_dif=rec_dif,
+                rec_dif_ci=rec_dif_ci,
+                prices=np.linspace(price_min, price_max, price_steps),
+                grades=np.linspace(grade_min, grade_max, grade_steps),
+                tphs=tphs,
+                tph=tph,
+            )
+            st.image(sweep["heatmap"])
+            st.download_button(
+                "Download Sweep Table",
+                data=sweep["grid"].to_csv(sep=";", index=False).encode("latin-1"),
+                file_name="economic_sweep.csv",
+            )
+
+        with st.expander("Laboratory Curve Uncertainty"):
+            # Bootstrap parametrico de los nodos de laboratorio
+            colb1, colb2, colb3 = st.columns(3)
+            with colb1:
+                lab_error = st.number_input(
+                    "Lab Recovery Error (std, points)", min_value=0.0, value=2.0
+                )
+            with colb2:
+                replicates = st.number_input(
+                    "Bootstrap Curves", min_value=10, max_value=10000, value=1000
+                )
+            with colb3:
+                bootstrap_n = st.number_input(
+                    "Samples per Curve", min_value=1000, value=20000, step=1000
+                )
+            bootstrap, _ = ECO_BOOTSTRAP_PIPELINE.run(
+                st.session_state,
+                p80=np.asarray(st.session_state.x, dtype=float),
+                recovery=np.asarray(st.session_state.y, dtype=float),
+                error=lab_error,
+                replicates=replicates,
+                seed=seed,
+                average_p80=average_p80,
+                std_p80_1=std_p80_1,
+                std_p80_2=std_p80_2,
+                n=bootstrap_n,
+                sampler=st.session_state.get("sampler", simulation.SAMPLERS[0]),
+                truncate=st.session_state.get("truncate", False),
+                shape=st.session_state.get("p80_shape"),
+                upper=st.session_state.curve.upper,
+                ton_diario=ton_diario,
+                ley=ley,
+                precio=precio,
+            )
+            band = bootstrap["band"]
+            for i, std_p80 in enumerate((std_p80_1, std_p80_2)):
+                low, mid, high = band["recovery"][i]
+                st.info(
+                    f"Simulated Recovery (std {std_p80}): {round(mid,2)}% "
+                    f"(95% band: {round(low,2)}% to {round(high,2)}%)"
+                )
+            low, mid, high = band["difference"]
+            st.info(
+                f"Recovery Difference: {round(mid,2)}% "
+                f"(95% band: {round(low,2)}% to {round(high,2)}%)"
+            )
+            low, mid, high = band["us_year"]
+            st.info(
+                f"Additional Yearly Income: {round(mid,):,} US$/year "
+                f"(95% band: {round(low,):,} to {round(high,):,} US$/year)"
+            )
+            st.image(bootstrap["chart"])
+
+        with st.expander("Strategy Comparison"):
+            # La primera fila es la estrategia base contra la que se compara
+            strategies = st.data_editor(
+                pd.DataFrame(
+                    {
+                        "Strategy": ["Baseline", "Strategy 1"],
+                        "Average P80": [float(average_p80), float(average_p80)],
+                        "Standard Deviation P80": [float(std_p80_1), float(std_p80_2)],
+                    }
+                ),
+                num_rows="dynamic",
+                key="eco_strategies",
+            ).dropna()
+            strategies = strategies[strategies["Standard Deviation P80"] > 0]
+            if strategies.empty:
+                st.warning("Add at least one strategy with a positive deviation.")
+            else:
+                names = [str(name) for name in strategies["Strategy"]]
+                means = strategies["Average P80"].to_numpy(dtype=float)
+                stds = strategies["Standard Deviation P80"].to_numpy(dtype=float)
+                comparison, _ = ECO_COMPARE_PIPELINE.run(
+                    st.session_state,
+                    p80=np.asarray(st.session_state.x, dtype=float),
+                    recovery=np.asarray(st.session_state.y, dtype=float),
+                    names=names,
+                    means=means,
+                    stds=stds,
+                    n=simul_number2,
+                    seed=seed,
+                    sampler=st.session_state.get("sampler", simulation.SAMPLERS[0]),
+                    truncate=st.session_state.get("truncate", False),
+                    shape=st.session_state.get("p80_shape"),
+                    upper=st.session_state.curve.upper,
+                    mode=st.session_state.get("calc_mode", CALC_MODES[0]),
+                    ton_diario=ton_diario,
+                    ley=ley,
+                    precio=precio,
+                    tails=st.session_state.curve.tails(),
+                )
+                st.dataframe(comparison["table"], hide_index=True)
+                st.image(comparison["chart"])
 
 
 if __name__ == "__main__":
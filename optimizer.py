@@ -0,0 +1,95 @@
+"""Operating point that maximizes the expected recovery or the revenue.
+
+The objective is the exact :func:`simulation.expected_recovery`, so there is
+no sampling noise and the gradient is analytic. A coarse grid evaluated in a
+single broadcast call gives the starting point, and L-BFGS-B refines it.
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+
+import economics
+import simulation
+
+
+def _objective(f, upper, lower, revenue):
+    def objective(point):
+        average_p80, std_p80 = point
+        value, d_average, d_std = simulation.expected_recovery_gradient(
+            f, average_p80, std_p80, upper=upper, lower=lower
+        )
+        if revenue is not None:
+            ton_diario, ley, precio, f80, reference_p80 = revenue
+            tph, d_tph = economics.bond_throughput(
+                average_p80, reference_p80, ton_diario, f80
+            )
+            scale = economics.additional_income(1, 1, ley, precio)[3]
+            value, d_average, d_std = (
+                scale * tph * value,
+                scale * (d_tph * value + tph * d_average),
+                scale * tph * d_std,
+            )
+        if not np.isfinite(value):
+            return np.inf, np.zeros(2)
+        return -value, -np.array([d_average, d_std])
+
+    return objective
+
+
+def optimal_p80(
+    f,
+    std_p80,
+    upper,
+    lower=simulation.P80_MIN,
+    std_max=None,
+    revenue=None,
+    mean_bounds=None,
+    grid=256,
+):
+    """Average P80, and std within ``[std_p80, std_max]``, with the best value.
+
+    The average is searched inside ``mean_bounds``, by default the whole
+    ``[lower, upper]`` window; the model page restricts it to the laboratory
+    range, where the spline is backed by data. Without ``std_max`` the
+    standard deviation is held at ``std_p80``. With
+    ``revenue=(ton_diario, ley, precio, f80, reference_p80)`` the objective is
+    the yearly income of the recovered copper, with the throughput scaled from
+    ``ton_diario`` at ``reference_p80`` by Bond's law; otherwise it is the
+    expected recovery. Returns a dict with the optimal ``average_p80``,
+    ``std_p80``, ``recovery`` and ``value`` of the objective.
+    """
+    std_max = std_p80 if std_max is None else max(std_max, std_p80)
+    mean_min, mean_max = (lower, upper) if mean_bounds is None else mean_bounds
+    objective = _objective(f, upper, lower, revenue)
+
+    # Punto de partida: el mejor nodo de una grilla gruesa, en una sola llamada
+    means = np.linspace(mean_min, mean_max, grid)
+    stds = np.linspace(std_p80, std_max, 16 if std_max > std_p80 else 1)
+    values = simulation.expected_recovery(
+        f, means[:, None], stds[None, :], upper=upper, lower=lower
+    )
+    if revenue is not None:
+        ton_diario, _, _, f80, reference_p80 = revenue
+        tph, _ = economics.bond_throughput(means, reference_p80, ton_diario, f80)
+        values = values * tph[:, None]
+    if not np.any(np.isfinite(values)):
+        raise ValueError("The recovery curve is not positive inside the P80 window")
+    i, j = np.unravel_index(np.nanargmax(values), values.shape)
+
+    result = minimize(
+        objective,
+        x0=[means[i], stds[j]],
+        jac=True,
+        method="L-BFGS-B",
+        bounds=[(mean_min, mean_max), (std_p80, std_max)],
+    )
+    average_p80, std_p80 = result.x
+    return {
+        "average_p80": average_p80,
+        "std_p80": std_p80,
+        "recovery": simulation.expected_recovery(
+            f, average_p80, std_p80, upper=upper, lower=lower
+        ),
+        "value": -result.fun,
+        "success": result.success,
+    }
@@ -0,0 +1,193 @@
+"""Process-pool execution backend for the simulation core.
+
+Large sample counts are split into independently seeded streams and large
+sensitivity grids into tiles of mean values. The split depends only on the
+job size, never on the number of workers, so for a given seed the result is
+the same whether the tasks run in a pool or in the current process.
+"""
+
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import simulation
+
+WORKERS = int(os.environ.get("APP_WORKERS", os.cpu_count() or 1))
+STREAM_SIZE = 2**20
+PARALLEL_MIN_SAMPLES = 2**21
+PARALLEL_MIN_CELLS = 2**24
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process pool shared by every session, sized once from ``APP_WORKERS``."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def run_tasks(function, tasks, workers=WORKERS, parallel=True):
+    """``[function(*task) for task in tasks]``, on the pool when worthwhile.
+
+    ``workers`` only caps how many tasks of this job are in the pool at once
+    (at most ``WORKERS``); the pool itself is never resized, so sessions with
+    different settings share the same worker processes.
+    """
+    workers = min(workers, WORKERS)
+    if not parallel or workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+    executor = get_executor()
+    results = [None] * len(tasks)
+    queue = enumerate(tasks)
+    pending = {
+        executor.submit(function, *task): index
+        for index, task in itertools.islice(queue, workers)
+    }
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                # Entra una tarea nueva por cada una que termina
+                for index, task in itertools.islice(queue, 1):
+                    pending[executor.submit(function, *task)] = index
+    finally:
+        for future in pending:
+            future.cancel()
+    return results
+
+
+def _stream_task(f, average_p80, std_p80, size, upper, lower, seed, options, bins):
+    sim = simulation.simulate(
+        f,
+        average_p80,
+        std_p80,
+        size,
+        upper,
+        lower=lower,
+        rng=np.random.default_rng(seed),
+        **options,
+    )
+    p80 = sim["Simulated_p80_check"]
+    positive = sim["recovery"] > 0
+    counts = np.histogram(p80[~np.isnan(p80)], bins=np.linspace(lower, upper, bins + 1))
+    return (
+        sim["recovery"][positive].sum(),
+        positive.sum(),
+        sim["std_error"],
+        counts[0],
+    )
+
+
+def simulate_parallel(
+    f,
+    average_p80,
+    std_p80,
+    simul_number,
+    upper,
+    lower=simulation.P80_MIN,
+    seed=None,
+    sampler=simulation.SAMPLERS[0],
+    truncate=False,
+    shape=None,
+    workers=WORKERS,
+    bins=20,
+):
+    """Summary of :func:`simulation.simulate` computed over seeded streams.
+
+    Only the statistics come back from the workers: the average recovery,
+    its standard error, the window mass and histogram counts of the valid
+    P80, so memory does not grow with ``simul_number``.
+    """
+    n_streams = math.ceil(simul_number / STREAM_SIZE)
+    sizes = np.diff(np.linspace(0, simul_number, n_streams + 1).astype(int))
+    seeds = np.random.SeedSequence(seed).spawn(n_streams)
+    options = {"sampler": sampler, "truncate": truncate, "shape": shape}
+    tasks = [
+        (f, average_p80, std_p80, size, upper, lower, stream_seed, options, bins)
+        for size, stream_seed in zip(sizes, seeds)
+    ]
+    results = run_tasks(
+        _stream_task, tasks, workers, simul_number >= PARALLEL_MIN_SAMPLES
+    )
+
+    total = sum(result[0] for result in results)
+    count = sum(result[1] for result in results)
+    # Streams are independent: weight each stream error by its share
+    variance = sum((result[1] / count * result[2]) ** 2 for result in results)
+    return {
+        "simul_recovery": total / count if count else np.nan,
+        "std_error": np.sqrt(variance) if count else np.nan,
+        "mass": simulation.window_mass(average_p80, std_p80, lower, upper, shape)[()],
+        "hist": (
+            sum(result[3] for result in results),
+            np.linspace(lower, upper, bins + 1),
+        ),
+    }
+
+
+def _grid_task(f, means, stds, simul_number, upper, lower, seed, options):
+    return simulation.simulate_grid(
+        f,
+        means,
+        stds,
+        simul_number,
+        upper,
+        lower=lower,
+        rng=np.random.default_rng(seed),
+        **options,
+    )
+
+
+def simulate_grid_parallel(
+    f,
+    means,
+    stds,
+    simul_number,
+    upper,
+    lower=simulation.P80_MIN,
+    seed=None,
+    sampler=simulation.SAMPLERS[0],
+    truncate=False,
+    shape=None,
+    workers=WORKERS,
+    tile_cells=2**22,
+):
+    """:func:`simulation.simulate_grid` split into tiles of mean values.
+
+    Every tile regenerates the same shared uniforms from ``seed``, so the grid
+    keeps its common random numbers and matches the serial result.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    means = np.asarray(means, dtype=float)
+    stds = np.asarray(stds, dtype=float)
+    rows = max(1, tile_cells // max(1, stds.size * simul_number))
+    options = {"sampler": sampler, "truncate": truncate, "shape": shape}
+    tasks = [
+        (
+            f,
+            means[start : start + rows],
+            stds,
+            simul_number,
+            upper,
+            lower,
+            seed,
+            options,
+        )
+        for start in range(0, means.size, rows)
+    ]
+    cells = means.size * stds.size * simul_number
+    results = run_tasks(_grid_task, tasks, workers, cells >= PARALLEL_MIN_CELLS)
+    return np.concatenate(results, axis=0)
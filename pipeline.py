@@ -0,0 +1,51 @@
+"""Stage-level incremental recomputation.
+
+A page is described as an ordered list of stages, each declaring the inputs
+it reads and the upstream stages it depends on. On every rerun a stage is
+recomputed only when one of its inputs, or the result of an upstream stage,
+changed since the last run; otherwise its stored result is reused.
+"""
+
+import cache
+
+
+class Stage:
+    def __init__(self, name, function, inputs=(), after=()):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.after = tuple(after)
+
+
+class Pipeline:
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = list(stages)
+
+    def run(self, store, **params):
+        """Run the stages in order, storing each result in ``store``.
+
+        ``store`` is any mutable mapping kept between reruns, usually
+        ``st.session_state``. The stage functions receive their declared inputs
+        and the results of their upstream stages as keyword arguments.
+        Returns the results of every stage and the names of the stages that
+        were recomputed.
+        """
+        results = {}
+        keys = {}
+        recomputed = []
+        for stage in self.stages:
+            inputs = {name: params[name] for name in stage.inputs}
+            key = cache.canonical_key(
+                stage.name, inputs, [keys[name] for name in stage.after]
+            )
+            slot = f"_pipeline_{self.name}_{stage.name}"
+            saved = store.get(slot)
+            if saved is None or saved[0] != key:
+                upstream = {name: results[name] for name in stage.after}
+                saved = (key, stage.function(**inputs, **upstream))
+                store[slot] = saved
+                recomputed.append(stage.name)
+            results[stage.name] = saved[1]
+            keys[stage.name] = key
+        return results, recomputed
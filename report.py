@@ -0,0 +1,122 @@
+"""PDF reports of flotation model scenarios, built in memory.
+
+Reports never touch the working directory: the chart comes in as PNG bytes,
+the logo and diagram come from :mod:`assets`, and the PDF is returned as
+bytes for ``st.download_button``. Generation runs on a small
+background thread pool so the page keeps responding; batch reports fan their
+scenarios out to the simulation process pool.
+"""
+
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+import assets
+import charts
+import parallel
+import simulation
+
+REPORT_WORKERS = 2
+TITLE = "Evaluation of Milling-Flotation Productivity Improvement Strategies"
+INTRO = "    Many available control strategies are associated with individual improvements for Flotation or Grinding, and very few address the interrelationship between Grinding and Flotation in search of a global optimum. A methodology is presented to evaluate different control strategies focused on reducing the dispersion of the degree of liberation that can cause significant recovery losses. The method relies on historical P80 measurements in the plant, generating a statistical model that represents the plant data. At the same time, it makes use of a P80 versus Laboratory recovery curve and the Monte Carlo method to evaluate the impact on the recovery of different P80 distributions generated by different control strategies.    "
+
+_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+
+
+def submit(function, *args, **kwargs):
+    """Run ``function`` on the report thread pool and return its future."""
+    return _executor.submit(function, *args, **kwargs)
+
+
+def _header(pdf):
+    pdf.add_page()
+    pdf.set_font("helvetica", "B", 16)
+    pdf.image(io.BytesIO(assets.logo()), x=180, y=0, w=30, h=30)
+    pdf.multi_cell(
+        w=150,
+        h=7,
+        text=TITLE,
+        border=0,
+        align="J",
+        new_x=XPos.LMARGIN,
+        new_y=YPos.NEXT,
+    )
+
+
+def build_report(
+    average_p80, std_p80, simul_number, p80, recovery, chart, simul_recovery
+):
+    """PDF bytes of one scenario; ``chart`` is the recovery chart as PNG."""
+    pdf = FPDF(orientation="P", unit="mm", format="A4")
+    _header(pdf)
+    pdf.set_font("helvetica", "", 12)
+    pdf.ln(28)
+    pdf.multi_cell(w=0, h=8, text=INTRO, border=1, align="J")
+    pdf.image(io.BytesIO(assets.diagram()), x=50, y=140, w=130, h=90)
+
+    _header(pdf)
+    pdf.set_font("helvetica", "", 12)
+    pdf.text(20, 40, "Parameters")
+    pdf.text(50, 50, f"Average P80: {average_p80}")
+    pdf.text(50, 60, f"Standard Deviation P80: {std_p80}")
+    pdf.text(50, 70, f"Number of Simulations: {simul_number}")
+    pdf.text(50, 80, f"Number of Nodes: {len(p80)}")
+    pdf.text(20, 95, "Laboratory Recovery versus P80 Table")
+    pdf.set_font("helvetica", "", 10)
+    for j, (x, y) in enumerate(zip(p80, recovery), start=1):
+        pdf.text(50, 100 + j * 7, f"P80 {j}: {x:g}  |  Recovery {j}: {y:g}")
+
+    pdf.image(io.BytesIO(chart), x=40, y=160, w=130, h=90)
+    pdf.set_font("helvetica", "B", 16)
+    pdf.text(60, 260, f"Simulated Recovery: {simul_recovery}")
+    return bytes(pdf.output())
+
+
+def scenario_report(curve, average_p80, std_p80, n, seed, options, exact):
+    """Simulate one scenario and build its report, in a worker process."""
+    nodes = (curve.nodes, curve(curve.nodes))
+    points = charts.curve_points(curve, curve.nodes)
+    shape = options.get("shape")
+    if exact:
+        simul_recovery = simulation.expected_recovery(
+            curve, average_p80, std_p80, upper=curve.upper, shape=shape
+        )
+        distribution = charts.density(average_p80, std_p80, curve.upper, shape)
+    else:
+        sim = simulation.simulate(
+            curve,
+            average_p80,
+            std_p80,
+            n,
+            upper=curve.upper,
+            rng=np.random.default_rng(seed),
+            **options,
+        )
+        simul_recovery = sim["simul_recovery"]
+        distribution = charts.histogram(sim["Simulated_p80_check"])
+    return build_report(
+        average_p80,
+        std_p80,
+        n,
+        nodes[0],
+        nodes[1],
+        charts.recovery_png(nodes, points, distribution),
+        round(float(simul_recovery), 2),
+    )
+
+
+def build_batch(curve, means, stds, n, seed, options, exact, workers):
+    """Zip archive with one report per ``(mean, std)`` scenario."""
+    tasks = [
+        (curve, mean, std, n, seed, options, exact) for mean, std in zip(means, stds)
+    ]
+    reports = parallel.run_tasks(scenario_report, tasks, workers)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for mean, std, pdf in zip(means, stds, reports):
+            archive.writestr(f"Report_P80_{mean:g}_{std:g}.pdf", pdf)
+    return buffer.getvalue()
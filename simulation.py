@@ -0,0 +1,840 @@
+"""Monte Carlo engine for the P80 versus recovery model.
+
+This module does not depend on Streamlit, so it can be imported from scripts,
+notebooks or worker processes.
+"""
+
+import math
+import warnings
+
+import numpy as np
+from scipy.interpolate import CubicSpline, PPoly
+from scipy.signal import fftconvolve, lfilter
+from scipy.stats import norm, qmc
+
+from curve import with_tails
+
+P80_MIN = 35
+
+
+SAMPLERS = ("Plain MC", "Antithetic", "Latin Hypercube", "Sobol")
+QMC_BATCHES = 8
+SHAPE_SIZE = 2048
+
+
+def draw_uniforms(simul_number, sampler=SAMPLERS[0], rng=None):
+    """Uniform numbers for the simulation and the independent unit of each.
+
+    ``groups[i]`` identifies the independent draw sample ``i`` belongs to:
+    every sample for plain MC, the pair for antithetic sampling and one of
+    ``QMC_BATCHES`` independently randomized batches for Latin hypercube and
+    scrambled Sobol points. It is used by :func:`standard_error`.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if sampler == SAMPLERS[0]:
+        return rng.random(simul_number), np.arange(simul_number)
+
+    if sampler == SAMPLERS[1]:
+        half = rng.random((simul_number + 1) // 2)
+        random = np.concatenate((half, 1 - half))[:simul_number]
+        groups = np.concatenate((np.arange(half.size), np.arange(half.size)))
+        return random, groups[:simul_number]
+
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler: {sampler}")
+
+    sizes = np.diff(np.linspace(0, simul_number, QMC_BATCHES + 1).astype(int))
+    batches = []
+    for size in sizes:
+        if sampler == SAMPLERS[2]:
+            engine = qmc.LatinHypercube(d=1, seed=rng)
+        else:
+            engine = qmc.Sobol(d=1, scramble=True, seed=rng)
+        with warnings.catch_warnings():
+            # Sobol balance is best for powers of two, any size is still valid
+            warnings.simplefilter("ignore", UserWarning)
+            batches.append(engine.random(size)[:, 0])
+    groups = np.repeat(np.arange(QMC_BATCHES), sizes)
+    return np.concatenate(batches), groups
+
+
+def p80_shape(counts, edges, kde=False, size=SHAPE_SIZE):
+    """Standardized inverse-cdf table of a P80 histogram.
+
+    The histogram (for example from :func:`ingest.p80_statistics`) is read as
+    a piecewise uniform density, optionally smoothed by a Gaussian KDE with
+    Silverman's bandwidth, and tabulated as the quantiles of
+    ``(P80 - mean) / std`` at ``size + 1`` evenly spaced probabilities. The
+    table keeps the skew and modes of the plant data while the mean and std
+    are still chosen freely, so a std reduction rescales it around its mean.
+    """
+    counts = np.asarray(counts, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    if kde:
+        centers = (edges[:-1] + edges[1:]) / 2
+        total = counts.sum()
+        mean = np.sum(counts * centers) / total
+        std = np.sqrt(np.sum(counts * (centers - mean) ** 2) / total)
+        cdf = np.cumsum(counts) / total
+        iqr = np.interp(0.75, cdf, centers) - np.interp(0.25, cdf, centers)
+        bandwidth = 0.9 * min(std, iqr / 1.34) * total ** (-1 / 5)
+        step = edges[1] - edges[0]
+        half = max(1, int(np.ceil(4 * bandwidth / step)))
+        kernel = norm.pdf(np.arange(-half, half + 1) * step / bandwidth)
+        counts = fftconvolve(np.pad(counts, half), kernel)
+        counts = counts[half : half + counts.size - 2 * half]
+        # Ruido de redondeo de la FFT lejos de los datos
+        counts[counts < 1e-12 * counts.max()] = 0
+        edges = np.concatenate(
+            (
+                edges[0] - step * np.arange(half, 0, -1),
+                edges,
+                edges[-1] + step * np.arange(1, half + 1),
+            )
+        )
+
+    nonzero = np.flatnonzero(counts > 0)
+    if nonzero.size == 0:
+        raise ValueError("The P80 histogram is empty")
+    # Sin los extremos vacios, la tabla empieza y termina en datos reales
+    counts = counts[nonzero[0] : nonzero[-1] + 1]
+    edges = edges[nonzero[0] : nonzero[-1] + 2]
+    cdf = np.concatenate(([0.0], np.cumsum(counts)))
+    table = np.interp(np.linspace(0, 1, size + 1), cdf / cdf[-1], edges)
+
+    # Momentos de la densidad uniforme por tramos que define la tabla
+    a, b = table[:-1], table[1:]
+    mean = np.mean((a + b) / 2)
+    std = np.sqrt(np.mean((a * a + a * b + b * b) / 3) - mean**2)
+    return (table - mean) / std
+
+
+def _shape_ppf(shape, random):
+    return np.interp(random, np.linspace(0, 1, shape.size), shape)
+
+
+def _shape_cdf(shape, z):
+    return np.interp(z, shape, np.linspace(0, 1, shape.size))
+
+
+def _shape_pdf(shape, z):
+    index = np.clip(np.searchsorted(shape, z, side="right") - 1, 0, shape.size - 2)
+    width = np.maximum(np.diff(shape), 1e-12)
+    inside = (z >= shape[0]) & (z <= shape[-1])
+    return np.where(inside, 1 / ((shape.size - 1) * width[index]), 0.0)
+
+
+def p80_pdf(x, average_p80, std_p80, shape=None):
+    """Density of the normal, or ``shape`` table, P80 distribution."""
+    if shape is None:
+        return norm.pdf(x, loc=average_p80, scale=std_p80)
+    return _shape_pdf(shape, (np.asarray(x) - average_p80) / std_p80) / std_p80
+
+
+def p80_samples(random, average_p80, std_p80, lower, upper, truncate=False, shape=None):
+    """Map uniform numbers to normal P80 samples.
+
+    With ``truncate`` the inverse cdf is taken over the truncated range
+    ``[lower, upper]`` only, so every sample falls inside the P80 window.
+    With a ``shape`` table from :func:`p80_shape` the standard normal is
+    replaced by that empirical distribution, sampled by table lookup.
+    """
+    if shape is not None:
+        return _shape_samples(
+            random, average_p80, std_p80, lower, upper, truncate, shape
+        )
+    if not truncate:
+        return average_p80 + std_p80 * norm.ppf(random)
+
+    safe_std = np.where(std_p80 > 0, std_p80, 1.0)
+    alpha = (lower - average_p80) / safe_std
+    beta = (upper - average_p80) / safe_std
+    # Work on the lower tail, where the normal cdf keeps its precision
+    flip = alpha > 0
+    alpha, beta = np.where(flip, -beta, alpha), np.where(flip, -alpha, beta)
+    random = np.where(flip, 1 - random, random)
+    cdf_alpha, cdf_beta = norm.cdf(alpha), norm.cdf(beta)
+    z = norm.ppf(cdf_alpha + random * (cdf_beta - cdf_alpha))
+    simulated_p80 = average_p80 + std_p80 * np.where(flip, -z, z)
+
+    inside = (average_p80 >= lower) & (average_p80 <= upper)
+    has_mass = np.where(std_p80 > 0, cdf_beta > cdf_alpha, inside)
+    return np.where(has_mass, np.clip(simulated_p80, lower, upper), np.nan)
+
+
+def _shape_samples(random, average_p80, std_p80, lower, upper, truncate, shape):
+    if not truncate:
+        return average_p80 + std_p80 * _shape_ppf(shape, random)
+
+    safe_std = np.where(std_p80 > 0, std_p80, 1.0)
+    cdf_alpha = _shape_cdf(shape, (lower - average_p80) / safe_std)
+    cdf_beta = _shape_cdf(shape, (upper - average_p80) / safe_std)
+    z = _shape_ppf(shape, cdf_alpha + random * (cdf_beta - cdf_alpha))
+    simulated_p80 = average_p80 + std_p80 * z
+
+    inside = (average_p80 >= lower) & (average_p80 <= upper)
+    has_mass = np.where(std_p80 > 0, cdf_beta > cdf_alpha, inside)
+    return np.where(has_mass, np.clip(simulated_p80, lower, upper), np.nan)
+
+
+def window_mass(average_p80, std_p80, lower, upper, shape=None):
+    """Probability of the P80 falling inside ``[lower, upper]``.
+
+    The P80 is normal, or follows the ``shape`` table of :func:`p80_shape`.
+    """
+    average_p80 = np.asarray(average_p80, dtype=float)
+    std_p80 = np.asarray(std_p80, dtype=float)
+    safe_std = np.where(std_p80 > 0, std_p80, 1.0)
+    cdf = norm.cdf if shape is None else lambda z: _shape_cdf(shape, z)
+    mass = cdf((upper - average_p80) / safe_std) - cdf((lower - average_p80) / safe_std)
+    inside = (average_p80 >= lower) & (average_p80 <= upper)
+    return np.where(std_p80 > 0, mass, inside.astype(float))
+
+
+def simulate(
+    f,
+    average_p80,
+    std_p80,
+    simul_number,
+    upper,
+    lower=P80_MIN,
+    rng=None,
+    sampler=SAMPLERS[0],
+    truncate=False,
+    shape=None,
+):
+    """Simulate P80 samples and evaluate the recovery curve on them.
+
+    Samples outside ``[lower, upper]`` are set to NaN, exactly as the old
+    row-wise ``check`` did; with ``truncate`` they are never generated. Returns
+    a dict with the simulated P80 arrays, the recovery per sample, the average
+    recovery over the samples with a positive recovery, its estimated
+    standard error and the probability mass of the P80 window.
+    """
+    random, groups = draw_uniforms(simul_number, sampler, rng)
+    simulated_p80 = p80_samples(
+        random, average_p80, std_p80, lower, upper, truncate, shape
+    )
+
+    valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+    simulated_p80_check = np.where(valid, simulated_p80, np.nan)
+
+    recovery = np.full(simul_number, np.nan)
+    recovery[valid] = f(simulated_p80_check[valid])
+
+    return {
+        "random": random,
+        "Simulated_p80": simulated_p80,
+        "Simulated_p80_check": simulated_p80_check,
+        "recovery": recovery,
+        "simul_recovery": mean_recovery(recovery),
+        "std_error": standard_error(recovery, groups),
+        "mass": window_mass(average_p80, std_p80, lower, upper, shape)[()],
+    }
+
+
+def mean_recovery(recovery):
+    """Average of the positive recoveries, NaN when there are none."""
+    positive = recovery[recovery > 0]
+    if positive.size == 0:
+        return np.nan
+    return positive.mean()
+
+
+def standard_error(recovery, groups):
+    """Standard error of :func:`mean_recovery`.
+
+    The average over positive recoveries is a ratio estimator, so its
+    linearized residuals are summed per independent group (see
+    :func:`draw_uniforms`) and the spread of those sums gives the error.
+    """
+    return _group_error(_influence(recovery), groups)
+
+
+def _influence(recovery):
+    """Linearized contribution of every sample to :func:`mean_recovery`."""
+    positive = recovery > 0
+    count = positive.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        average = np.where(positive, recovery, 0).sum(axis=-1, keepdims=True) / count
+        return np.where(positive, recovery - average, 0) / count
+
+
+def _group_error(influence, groups):
+    n_groups = np.count_nonzero(np.bincount(groups))
+    if n_groups < 2 or not np.all(np.isfinite(influence)):
+        return np.nan
+    group_sum = np.bincount(groups, weights=influence)
+    return np.sqrt(n_groups / (n_groups - 1) * np.sum(group_sum**2))
+
+
+def simulate_scenarios(
+    f,
+    means,
+    stds,
+    simul_number,
+    upper,
+    lower=P80_MIN,
+    rng=None,
+    sampler=SAMPLERS[0],
+    truncate=False,
+    shape=None,
+):
+    """Simulate several P80 scenarios with common random numbers.
+
+    All scenarios are driven by the same uniform draws, so differences
+    between them are not swamped by sampling noise. Arrays in the result have
+    one row per scenario, except ``random`` and ``groups`` which are shared.
+    """
+    random, groups = draw_uniforms(simul_number, sampler, rng)
+    means = np.asarray(means, dtype=float)[:, None]
+    stds = np.asarray(stds, dtype=float)[:, None]
+
+    simulated_p80 = p80_samples(random, means, stds, lower, upper, truncate, shape)
+    valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+    simulated_p80_check = np.where(valid, simulated_p80, np.nan)
+    recovery = np.where(valid, f(np.where(valid, simulated_p80, lower)), np.nan)
+
+    influence = _influence(recovery)
+    with np.errstate(invalid="ignore"):
+        simul_recovery = np.nanmean(np.where(recovery > 0, recovery, np.nan), axis=1)
+    return {
+        "random": random,
+        "groups": groups,
+        "Simulated_p80": simulated_p80,
+        "Simulated_p80_check": simulated_p80_check,
+        "recovery": recovery,
+        "simul_recovery": simul_recovery,
+        "std_error": np.array([_group_error(row, groups) for row in influence]),
+        "influence": influence,
+        "mass": window_mass(means[:, 0], stds[:, 0], lower, upper, shape),
+    }
+
+
+def scenario(sim, i):
+    """Single scenario ``i`` of :func:`simulate_scenarios` as a simulate() dict."""
+    return {
+        key: value[i] if key not in ("random", "groups") else value
+        for key, value in sim.items()
+    }
+
+
+def recovery_difference(sim, i, j, confidence=0.95):
+    """Recovery of scenario ``j`` minus scenario ``i`` with a paired interval.
+
+    The common random numbers make the two estimates strongly correlated, so
+    the error of the difference is taken from the paired influence of every
+    sample instead of adding the two standard errors.
+    """
+    difference = sim["simul_recovery"][j] - sim["simul_recovery"][i]
+    error = _group_error(sim["influence"][j] - sim["influence"][i], sim["groups"])
+    half_width = norm.ppf(0.5 + confidence / 2) * error
+    return difference, (difference - half_width, difference + half_width)
+
+
+def compare_strategies(sim, baseline=0, confidence=0.95):
+    """Every scenario of :func:`simulate_scenarios` against ``baseline``.
+
+    Returns arrays with one value per scenario: the average recovery, its
+    standard error, and the paired difference versus the baseline scenario
+    with the bounds of its confidence interval.
+    """
+    paired = sim["influence"] - sim["influence"][baseline]
+    errors = np.array([_group_error(row, sim["groups"]) for row in paired])
+    errors[baseline] = 0.0
+    difference = sim["simul_recovery"] - sim["simul_recovery"][baseline]
+    half_width = norm.ppf(0.5 + confidence / 2) * errors
+    return {
+        "simul_recovery": sim["simul_recovery"],
+        "std_error": sim["std_error"],
+        "difference": difference,
+        "difference_low": difference - half_width,
+        "difference_high": difference + half_width,
+    }
+
+
+def simulate_grid(
+    f,
+    means,
+    stds,
+    simul_number,
+    upper,
+    lower=P80_MIN,
+    rng=None,
+    max_block=2**22,
+    sampler=SAMPLERS[0],
+    truncate=False,
+    shape=None,
+):
+    """Average recovery for every (mean, std) pair of a sensitivity grid.
+
+    One block of standard normals is shared by the whole grid and scaled by
+    broadcasting into a ``(means, stds, samples)`` array, so the recovery curve
+    is evaluated once per block instead of once per cell. Large sample counts
+    are processed in slices of at most ``max_block`` grid values to bound
+    memory. With ``truncate`` every cell samples its own truncated normal from
+    the same uniforms. Returns an array of shape ``(len(means), len(stds))``.
+    """
+    means = np.asarray(means, dtype=float)[:, None, None]
+    stds = np.asarray(stds, dtype=float)[None, :, None]
+    random = draw_uniforms(simul_number, sampler, rng)[0]
+
+    total = np.zeros((means.shape[0], stds.shape[1]))
+    count = np.zeros((means.shape[0], stds.shape[1]))
+    step = max(1, max_block // total.size)
+    for start in range(0, simul_number, step):
+        simulated_p80 = p80_samples(
+            random[start : start + step], means, stds, lower, upper, truncate, shape
+        )
+        valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+        recovery = np.where(valid, f(np.where(valid, simulated_p80, lower)), np.nan)
+        positive = recovery > 0
+        total += np.where(positive, recovery, 0).sum(axis=-1)
+        count += positive.sum(axis=-1)
+
+    with np.errstate(invalid="ignore"):
+        return total / count
+
+
+def curve_ensemble(p80, recovery, error, replicates, rng=None):
+    """Recovery curves through laboratory recoveries perturbed by their error.
+
+    Each node recovery gets independent normal noise of std ``error``
+    (recovery points), and all ``replicates`` natural splines are fitted in
+    one batched ``CubicSpline`` call with a 2D ``y`` and given the same linear
+    tails as :class:`curve.RecoveryCurve`. Evaluating the result on an array
+    of shape ``s`` gives shape ``s + (replicates,)``.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    recovery = np.asarray(recovery, dtype=float)
+    noise = error * rng.standard_normal((recovery.size, replicates))
+    spline = CubicSpline(
+        np.asarray(p80, dtype=float), recovery[:, None] + noise, bc_type="natural"
+    )
+    breaks, coefficients = with_tails(spline)
+    return PPoly(coefficients, breaks)
+
+
+def ensemble_recovery(
+    curves,
+    means,
+    stds,
+    simul_number,
+    upper,
+    lower=P80_MIN,
+    rng=None,
+    sampler=SAMPLERS[0],
+    truncate=False,
+    shape=None,
+    max_block=2**22,
+):
+    """Average recovery of every curve of :func:`curve_ensemble` per scenario.
+
+    All curves and scenarios share the same P80 samples, so the spread across
+    curves reflects the laboratory error and not sampling noise. Samples are
+    processed in slices of at most ``max_block`` curve evaluations. Returns
+    an array of shape ``(len(means), replicates)``.
+    """
+    random = draw_uniforms(simul_number, sampler, rng)[0]
+    means = np.asarray(means, dtype=float)[:, None]
+    stds = np.asarray(stds, dtype=float)[:, None]
+    simulated_p80 = p80_samples(random, means, stds, lower, upper, truncate, shape)
+    valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+    simulated_p80 = np.where(valid, simulated_p80, lower)
+
+    replicates = curves.c.shape[-1]
+    total = np.zeros((means.shape[0], replicates))
+    count = np.zeros((means.shape[0], replicates))
+    step = max(1, max_block // (means.shape[0] * replicates))
+    for start in range(0, simul_number, step):
+        recovery = curves(simulated_p80[:, start : start + step])
+        positive = valid[:, start : start + step, None] & (recovery > 0)
+        total += np.where(positive, recovery, 0).sum(axis=1)
+        count += positive.sum(axis=1)
+
+    with np.errstate(invalid="ignore"):
+        return total / count
+
+
+def _positive_segments(f, lower, upper):
+    """Sub-intervals of ``[lower, upper]`` where ``f`` is positive.
+
+    Returns the segment bounds and, for every segment, the index of the
+    polynomial piece of ``f`` that covers it.
+    """
+    roots = f.roots(extrapolate=True)
+    roots = np.real(roots[np.isfinite(roots)])
+    cuts = np.concatenate(([lower, upper], f.x, roots))
+    cuts = np.unique(cuts[(cuts >= lower) & (cuts <= upper)])
+    left, right = cuts[:-1], cuts[1:]
+    keep = f((left + right) / 2) > 0
+    left, right = left[keep], right[keep]
+    piece = np.clip(np.searchsorted(f.x, (left + right) / 2) - 1, 0, len(f.x) - 2)
+    return left, right, piece
+
+
+def _normal_partial_moments(alpha, beta, order):
+    """``M[j] = integral of z**j * pdf(z)`` over ``[alpha, beta]``, j <= order."""
+    pdf_a, pdf_b = norm.pdf(alpha), norm.pdf(beta)
+    moments = [norm.cdf(beta) - norm.cdf(alpha), pdf_a - pdf_b]
+    pow_a, pow_b = np.ones_like(alpha), np.ones_like(beta)
+    for j in range(2, order + 1):
+        pow_a, pow_b = pow_a * alpha, pow_b * beta
+        moments.append((j - 1) * moments[j - 2] + pdf_a * pow_a - pdf_b * pow_b)
+    return moments[: order + 1]
+
+
+def _spline_normal_integrals(f, mu, sigma, left, right, piece, extra=0):
+    """``I[e] = integral of f(mu + sigma * z) * z**e * pdf(z)`` over the segments.
+
+    Returns ``I[e]`` for ``e <= extra`` and the plain normal moments ``M[j]``
+    for ``j <= extra``, both summed over the segments.
+    """
+    order = f.c.shape[0] - 1
+    moments = _normal_partial_moments(
+        (left - mu) / sigma, (right - mu) / sigma, order + extra
+    )
+
+    # Each piece is sum_k c[k] * (x - x_i)**(order - k) with x = mu + sigma * z.
+    shift = mu - f.x[piece]
+    integrals = []
+    for e in range(extra + 1):
+        total = np.zeros(np.broadcast(mu, left).shape)
+        for k in range(order + 1):
+            power = order - k
+            term = np.zeros_like(total)
+            for j in range(power + 1):
+                binom = math.comb(power, j)
+                term += binom * sigma**j * shift ** (power - j) * moments[j + e]
+            total += f.c[k, piece] * term
+        integrals.append(total.sum(axis=-1))
+    return integrals, [m.sum(axis=-1) for m in moments[: extra + 1]]
+
+
+def _positive_primitives(f, lower, upper):
+    """Running integrals of ``f`` and of its support over the positive region.
+
+    Returns ``(breaks, integral, length)``: two antiderivative ``PPoly``
+    objects that are flat outside the positive segments of ``[lower, upper]``
+    and are evaluated inside ``[breaks[0], breaks[-1]]``.
+    """
+    left, right, _ = _positive_segments(f, lower, upper)
+    breaks = np.unique(np.concatenate((left, right)))
+    start = breaks[:-1]
+    positive = np.isin(start, left)
+    order = f.c.shape[0] - 1
+    # Taylor en el inicio de cada tramo: f(a, nu) / nu!
+    coefficients = np.zeros((order + 1, start.size))
+    for nu in range(order + 1):
+        coefficients[order - nu, positive] = f(start[positive], nu) / math.factorial(nu)
+    indicator = positive[None, :].astype(float)
+    integral = PPoly(coefficients, breaks).antiderivative()
+    length = PPoly(indicator, breaks).antiderivative()
+    return breaks, integral, length
+
+
+def _expected_recovery_shape(f, average_p80, std_p80, upper, lower, shape):
+    # Cada tramo de la tabla tiene masa uniforme: se integra f con su primitiva
+    breaks, integral, length = _positive_primitives(f, lower, upper)
+    if breaks.size < 2:
+        return np.full(average_p80.shape, np.nan)
+    mu = average_p80.reshape(-1, 1)
+    sigma = std_p80.reshape(-1, 1)
+    numerator = np.empty(mu.shape[0])
+    mass = np.empty(mu.shape[0])
+    rows = max(1, 2**20 // shape.size)
+    for start in range(0, mu.shape[0], rows):
+        x = mu[start : start + rows] + sigma[start : start + rows] * shape
+        width = np.maximum(np.diff(x, axis=-1), 1e-12)
+        x = np.clip(x, breaks[0], breaks[-1])
+        numerator[start : start + rows] = np.sum(np.diff(integral(x)) / width, axis=-1)
+        mass[start : start + rows] = np.sum(np.diff(length(x)) / width, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (numerator / mass).reshape(average_p80.shape)
+
+
+def expected_recovery(f, average_p80, std_p80, upper, lower=P80_MIN, shape=None):
+    """Exact expected recovery, without sampling.
+
+    Computes the same quantity the Monte Carlo path estimates: the mean of
+    ``f`` over a normal P80 distribution restricted to ``[lower, upper]`` and
+    to the region where ``f`` is positive. Every polynomial piece of the
+    spline (``f.c``, ``f.x``) is integrated in closed form against the normal
+    pdf. ``average_p80`` and ``std_p80`` may be arrays and are broadcast
+    together, so thousands of scenarios are evaluated in one call. With a
+    ``shape`` table from :func:`p80_shape`, every quantile interval of the
+    table is a uniform slice of mass and is integrated with the antiderivative
+    of the spline instead.
+    """
+    average_p80, std_p80 = np.broadcast_arrays(
+        np.asarray(average_p80, dtype=float), np.asarray(std_p80, dtype=float)
+    )
+    if shape is not None:
+        safe_std = np.where(std_p80 > 0, std_p80, 1.0)
+        result = _expected_recovery_shape(f, average_p80, safe_std, upper, lower, shape)
+    else:
+        left, right, piece = _positive_segments(f, lower, upper)
+        mu = average_p80[..., None]
+        sigma = np.where(std_p80 > 0, std_p80, 1.0)[..., None]
+        (numerator,), (mass,) = _spline_normal_integrals(
+            f, mu, sigma, left, right, piece
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = numerator / mass
+
+    # A zero standard deviation is a point mass at the average P80.
+    point = f(average_p80)
+    inside = (average_p80 >= lower) & (average_p80 <= upper) & (point > 0)
+    result = np.where(std_p80 > 0, result, np.where(inside, point, np.nan))
+    return result[()] if result.ndim == 0 else result
+
+
+def expected_recovery_gradient(f, average_p80, std_p80, upper, lower=P80_MIN):
+    """:func:`expected_recovery` and its derivatives by average and std P80.
+
+    The integration limits (the window and the roots of ``f``) do not move
+    with the distribution, so differentiating under the integral only brings
+    down the score of the normal pdf, ``z / sigma`` for the average and
+    ``(z**2 - 1) / sigma`` for the std. Both are closed-form partial moments,
+    the same ones used for the value. Returns ``(value, d_average, d_std)``;
+    ``std_p80`` must be positive.
+    """
+    average_p80, std_p80 = np.broadcast_arrays(
+        np.asarray(average_p80, dtype=float), np.asarray(std_p80, dtype=float)
+    )
+    left, right, piece = _positive_segments(f, lower, upper)
+    mu = average_p80[..., None]
+    sigma = std_p80[..., None]
+    (i0, i1, i2), (m0, m1, m2) = _spline_normal_integrals(
+        f, mu, sigma, left, right, piece, extra=2
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        value = i0 / m0
+        d_average = (i1 - value * m1) / (std_p80 * m0)
+        d_std = (i2 - value * m2) / (std_p80 * m0)
+    if value.ndim == 0:
+        return value[()], d_average[()], d_std[()]
+    return value, d_average, d_std
+
+
+def response_surface(curve, means, stds, upper, lower=P80_MIN, step=0.25, shape=None):
+    """Expected recovery over a mean x std grid by FFT Gaussian smoothing.
+
+    For a fixed standard deviation the expected recovery as a function of the
+    mean P80 is the curve convolved with a Gaussian kernel. The curve is
+    sampled once on a uniform grid of spacing ``step`` (restricted to the P80
+    window and to positive recoveries, as in the Monte Carlo path) and
+    smoothed for every requested std in a single batched FFT convolution.
+    With a ``shape`` table the kernel is its piecewise uniform density instead
+    of the Gaussian. Returns an array of shape ``(len(means), len(stds))``.
+    """
+    means = np.asarray(means, dtype=float)
+    stds = np.asarray(stds, dtype=float)
+
+    x = np.arange(min(lower, means.min()), max(upper, means.max()) + step, step)
+    recovery = curve(x)
+    weight = ((x >= lower) & (x <= upper) & (recovery > 0)).astype(float)
+
+    reach = 6 if shape is None else np.abs(shape).max()
+    half = max(1, int(np.ceil(reach * stds.max() / step)))
+    offsets = np.arange(-half, half + 1) * step
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if shape is None:
+            kernels = np.exp(-0.5 * (offsets[None, :] / stds[:, None]) ** 2)
+        else:
+            # La convolucion invierte el nucleo: se evalua en -offset
+            kernels = _shape_pdf(shape, -offsets[None, :] / stds[:, None])
+    kernels[stds <= 0] = offsets == 0
+
+    inside = slice(half, half + x.size)
+    numerator = fftconvolve((weight * recovery)[None, :], kernels, axes=1)[:, inside]
+    denominator = fftconvolve(weight[None, :], kernels, axes=1)[:, inside]
+    # Ignore FFT round-off where the window has (numerically) no mass
+    denominator[denominator < 1e-9 * kernels.sum(axis=1, keepdims=True)] = np.nan
+    surface = numerator / denominator
+
+    return np.stack([np.interp(means, x, row) for row in surface], axis=1)
+
+
+def update_moments(moments, values):
+    """Merge a block of values into running ``(count, mean, m2)`` moments.
+
+    This is Welford's online update applied block-wise (Chan et al.), so the
+    result does not depend on how the data was split.
+    """
+    count, mean, m2 = moments
+    block_count = values.size
+    if block_count == 0:
+        return moments
+    block_mean = values.mean()
+    block_m2 = np.sum((values - block_mean) ** 2)
+    total = count + block_count
+    delta = block_mean - mean
+    mean = mean + delta * block_count / total
+    m2 = m2 + block_m2 + delta**2 * count * block_count / total
+    return total, mean, m2
+
+
+def simulate_stream(
+    f,
+    average_p80,
+    std_p80,
+    simul_number,
+    upper,
+    lower=P80_MIN,
+    rng=None,
+    sampler=SAMPLERS[0],
+    truncate=False,
+    shape=None,
+    chunk_size=2**16,
+    tolerance=0.0,
+    bins=20,
+):
+    """Memory-bounded version of :func:`simulate`.
+
+    Samples are generated in blocks of ``chunk_size`` and discarded once they
+    have been folded into running statistics: Welford moments of the
+    positive recoveries, histogram counts of the valid P80 and its minimum
+    and maximum. A state dict is yielded after every block so a chart can be
+    updated while the simulation runs. The run stops early once the standard
+    error falls below ``tolerance`` (0 disables early stopping). The error
+    treats samples as independent, which is conservative for the
+    variance-reduced samplers.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    edges = np.linspace(lower, upper, bins + 1)
+    state = {
+        "block": 0,
+        "samples": 0,
+        "hist": (np.zeros(bins, dtype=np.int64), edges),
+        "p80_min": np.nan,
+        "p80_max": np.nan,
+        "done": False,
+    }
+    moments = (0, 0.0, 0.0)
+    while state["samples"] < simul_number and not state["done"]:
+        size = min(chunk_size, simul_number - state["samples"])
+        random, _ = draw_uniforms(size, sampler, rng)
+        simulated_p80 = p80_samples(
+            random, average_p80, std_p80, lower, upper, truncate, shape
+        )
+        valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+        simulated_p80 = simulated_p80[valid]
+        recovery = f(simulated_p80)
+
+        moments = update_moments(moments, recovery[recovery > 0])
+        count, mean, m2 = moments
+        state["block"] += 1
+        state["samples"] += size
+        state["hist"][0][:] += np.histogram(simulated_p80, bins=edges)[0]
+        if simulated_p80.size:
+            state["p80_min"] = np.fmin(state["p80_min"], simulated_p80.min())
+            state["p80_max"] = np.fmax(state["p80_max"], simulated_p80.max())
+        state["count"] = count
+        state["simul_recovery"] = mean if count else np.nan
+        state["std_error"] = np.sqrt(m2 / (count - 1) / count) if count > 1 else np.nan
+        state["done"] = state["samples"] >= simul_number or (
+            tolerance > 0 and state["std_error"] < tolerance
+        )
+        yield state
+
+
+def arma_response(ar=(), ma=(), tolerance=1e-9):
+    """Impulse response of the ARMA filter, long enough for it to die out.
+
+    ``ar`` and ``ma`` are the coefficients of
+    ``x[t] = sum(ar[i] * x[t-1-i]) + e[t] + sum(ma[j] * e[t-1-j])``.
+    """
+    a = np.concatenate(([1.0], -np.asarray(ar, dtype=float)))
+    b = np.concatenate(([1.0], np.asarray(ma, dtype=float)))
+    radius = np.max(np.abs(np.roots(a)), initial=0.0)
+    if radius >= 1:
+        raise ValueError("The AR coefficients do not describe a stationary process")
+    length = b.size
+    if radius > 0:
+        length += math.ceil(math.log(tolerance) / math.log(radius))
+    impulse = np.zeros(length)
+    impulse[0] = 1.0
+    return lfilter(b, a, impulse)
+
+
+def simulate_series(
+    f,
+    average_p80,
+    std_p80,
+    steps,
+    replicates,
+    upper,
+    lower=P80_MIN,
+    ar=(),
+    ma=(),
+    rng=None,
+    periods=(("shift", 480), ("day", 1440)),
+    max_block=2**22,
+):
+    """Autocorrelated P80 trajectories fed through the recovery curve.
+
+    ``replicates`` independent ARMA trajectories of ``steps`` time steps are
+    generated with ``scipy.signal.lfilter``, scaled so the P80 keeps the
+    marginal ``average_p80`` and ``std_p80``, and started from the stationary
+    state by a burn-in. They are produced in blocks of about ``max_block``
+    values, carrying the filter state between blocks, and reduced to the
+    average recovery of every period (``periods`` gives the name and the
+    number of steps of each). The average uses the positive recoveries inside
+    the P80 window, as in :func:`simulate`. A state dict is yielded after
+    every block; ``state[name]`` is a ``(replicates, periods)`` array.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    a = np.concatenate(([1.0], -np.asarray(ar, dtype=float)))
+    b = np.concatenate(([1.0], np.asarray(ma, dtype=float)))
+    response = arma_response(ar, ma)
+    scale = std_p80 / np.sqrt(np.sum(response**2))
+    width = max(1, max_block // replicates)
+
+    def blocks(total):
+        zi = np.zeros((replicates, max(a.size, b.size) - 1))
+        for start in range(0, total, width):
+            noise = rng.standard_normal((replicates, min(width, total - start)))
+            series, zi[:] = lfilter(b, a, noise, axis=1, zi=zi)
+            yield start, series
+
+    # El calentamiento deja al filtro en su estado estacionario
+    burn_in = response.size
+    generator = blocks(burn_in + steps)
+    sums = {
+        name: np.zeros((replicates, -(-steps // length))) for name, length in periods
+    }
+    counts = {name: np.zeros_like(value) for name, value in sums.items()}
+    state = {"steps": 0, "done": False}
+    for start, series in generator:
+        first = max(0, burn_in - start)
+        if first >= series.shape[1]:
+            continue
+        simulated_p80 = average_p80 + scale * series[:, first:]
+        valid = (simulated_p80 >= lower) & (simulated_p80 <= upper)
+        recovery = f(np.where(valid, simulated_p80, lower))
+        positive = valid & (recovery > 0)
+        recovery = np.where(positive, recovery, 0.0)
+
+        time = state["steps"] + np.arange(simulated_p80.shape[1])
+        for name, length in periods:
+            period = time // length
+            starts = np.flatnonzero(np.diff(period, prepend=-1))
+            sums[name][:, period[starts]] += np.add.reduceat(recovery, starts, axis=1)
+            counts[name][:, period[starts]] += np.add.reduceat(positive, starts, axis=1)
+
+        state["steps"] += simulated_p80.shape[1]
+        state["done"] = state["steps"] >= steps
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for name, _ in periods:
+                state[name] = sums[name] / counts[name]
+            name = periods[0][0]
+            state["simul_recovery"] = sums[name].sum() / counts[name].sum()
+        yield state
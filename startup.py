@@ -0,0 +1,106 @@
+"""Deferred imports and cold-start measurements.
+
+Heavy modules (scipy, matplotlib, altair, fpdf, pyarrow, PIL) are reached
+through :func:`lazy` proxies, so they are imported the first time a page
+actually uses them instead of when the login screen loads. The time spent in
+each first import is recorded, and :func:`report` gives it together with the
+time since this module was imported and the peak resident memory.
+
+``python startup.py`` runs the app headless in a fresh process, opens every
+page in turn and prints the cold-start time and peak memory after each one.
+"""
+
+import importlib
+import resource
+import sys
+import threading
+import time
+
+from streamlit.logger import get_logger
+
+STARTED = time.perf_counter()
+IMPORTS = {}
+
+logger = get_logger(__name__)
+_reported = threading.Event()
+
+
+class _LazyModule:
+    """Stand-in for a module that imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        module = sys.modules.get(self._name)
+        if module is None:
+            # import_module toma el lock de importacion: es seguro entre sesiones
+            started = time.perf_counter()
+            module = importlib.import_module(self._name)
+            IMPORTS.setdefault(self._name, time.perf_counter() - started)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy(name):
+    """Module ``name``, or a proxy that imports it when it is first used."""
+    return sys.modules.get(name) or _LazyModule(name)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB y macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def report():
+    return {
+        "elapsed": time.perf_counter() - STARTED,
+        "peak_rss_mb": peak_rss_mb(),
+        "imports": dict(IMPORTS),
+    }
+
+
+def log_once(stage):
+    """Log the startup report the first time the app reaches ``stage``."""
+    if _reported.is_set():
+        return
+    _reported.set()
+    startup = report()
+    logger.info(
+        "%s ready in %.2f s, peak RSS %.0f MB",
+        stage,
+        startup["elapsed"],
+        startup["peak_rss_mb"],
+    )
+
+
+def main(script="model.py"):
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    app = AppTest.from_file(script, default_timeout=600)
+    app.run()
+    rows = [("Login", time.perf_counter() - started, peak_rss_mb())]
+    app.session_state["condicion"] = True
+    app.run()
+    pages = app.sidebar.radio[0].options
+    for page in pages:
+        app.sidebar.radio[0].set_value(page).run()
+        if app.exception:
+            raise RuntimeError(f"{page}: {app.exception[0].value}")
+        rows.append((page, time.perf_counter() - started, peak_rss_mb()))
+    print(f"{'Page':<24}{'Elapsed (s)':>12}{'Peak RSS (MB)':>15}")
+    for page, elapsed, rss in rows:
+        print(f"{page:<24}{elapsed:>12.2f}{rss:>15.0f}")
+    print("First imports:")
+    # La app importa su propia copia de este modulo como "startup"
+    for name, seconds in sys.modules["startup"].IMPORTS.items():
+        print(f"  {name:<22}{seconds:>12.2f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])